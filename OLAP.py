@@ -1,31 +1,100 @@
-import matplotlib
-matplotlib.use('Agg')  
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output, State
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import io
-import base64
-import random
-
-df = pd.read_csv('D:/diabetes+130-us+hospitals+for+years+1999-2008/cleaned_diabetic_data_with_Median.csv')
-
-readmitted_mapping = {
-    '>30': 'Up',
-    '<30': 'Down',
-    'NO': 'No'
-}
-df['readmitted_mapped'] = df['readmitted'].map(readmitted_mapping)
+import itertools
+import os
+import sys
+
+import pair_jobs
+import report
+from figure_cache import FigureCache
+from job_queue import DONE, QUEUED, RUNNING, JobQueue, progress_bar
+from metrics import instrument, stage
+from pair_jobs import encode_figure
+from report import DRUG_COLORS, Bundle, add_bundle_route
+from startup import DATA_LOAD, LazyDataset, add_report_route, lazy_import, timed
+
+with timed('import dash'):
+    import dash
+    import dash_core_components as dcc
+    import dash_html_components as html
+    from dash.dependencies import Input, Output
+
+# Plotting and analysis libraries are imported when a figure is first rendered,
+# so a new worker (or a reloaded debug server) answers requests without them.
+cohort_index = lazy_import('cohort_index')
+
+
+def load_data():
+    with timed('import ingest'):
+        from ingest import LiveDataset
+    return LiveDataset()
+
+
+# Follows batches appended with ingest.py; loaded in the background or on first use (DASH_DATA_LOAD).
+data = LazyDataset(load_data, 'OLAP data')
+
+def refresh_data(force=False):
+    data.refresh(force)
+
+# Pre-render every figure into the cache once the data is loaded (--warm or OLAP_WARM_FIGURES).
+WARM_FIGURES = '--warm' in sys.argv or bool(os.environ.get('OLAP_WARM_FIGURES'))
 
-app = dash.Dash(__name__)
+figure_cache = FigureCache(max_bytes=int(os.environ.get('OLAP_FIGURE_CACHE_MB', '64')) * 1024 * 1024,
+                           cache_dir=os.environ.get('OLAP_FIGURE_CACHE_DIR'),
+                           max_disk_bytes=int(os.environ.get('OLAP_FIGURE_CACHE_DIR_MB', '256')) * 1024 * 1024)
 
+# Drug-pair figures are rendered in a process pool so the request thread returns at once.
+jobs = JobQueue()
 
-app.layout = html.Div([
+# Figures of the whole population rendered ahead of time by report.py (DIABETES_REPORT_DIR).
+bundle = Bundle()
+
+# The figures are drawn by report.py, so the bundle and live renders look the same.
+drug_colors = DRUG_COLORS
+
+# Cohort filters with a multi-select dropdown each; time_in_hospital has a range slider.
+cohort_dropdowns = {
+    'age': 'Age',
+    'gender': 'Gender',
+    'admission_type_id': 'Admission Type',
+    'A1Cresult': 'A1C Result',
+    'max_glu_serum': 'Max Glucose Serum'
+}
+
+# admission_type_id descriptions from the extract's IDs_mapping.csv.
+admission_types = {
+    1: 'Emergency',
+    2: 'Urgent',
+    3: 'Elective',
+    4: 'Newborn',
+    5: 'Not Available',
+    6: 'NULL',
+    7: 'Trauma Center',
+    8: 'Not Mapped'
+}
+
+layout = html.Div([
     html.H1("Medication Combination Effectiveness ", style={'textAlign': 'center', 'marginBottom': '30px'}),
 
+    html.Div(id='cohort-panel', children=[
+        html.Label("Cohort:", style={'fontSize': '20px', 'fontWeight': 'bold'}),
+        html.Div([
+            dcc.Dropdown(
+                id=f'cohort-{column}',
+                options=[],
+                value=[],
+                multi=True,
+                placeholder=f"{label}: all",
+                style={'width': '19%', 'display': 'inline-block', 'margin': '0 2px', 'verticalAlign': 'top'}
+            )
+            for column, label in cohort_dropdowns.items()
+        ], style={'marginTop': '10px'}),
+        html.Div([
+            html.Label("Days in Hospital:"),
+            dcc.RangeSlider(id='cohort-time_in_hospital', min=1, max=14, step=1, value=[1, 14])
+        ], style={'width': '60%', 'margin': '20px auto 0'}),
+        html.Div(id='cohort-size', style={'marginTop': '10px'})
+    ], style={'textAlign': 'center', 'marginBottom': '40px'}),
+    dcc.Store(id='cohort-filters'),
+
     html.Div([
         html.Label("Select Drug 1:", style={'fontSize': '20px', 'fontWeight': 'bold'}),
         dcc.Dropdown(
@@ -78,73 +147,118 @@ app.layout = html.Div([
                     })
     ]),
 
+    dcc.Store(id='relationship-job'),
+    dcc.Interval(id='relationship-poll', interval=500, disabled=True),
+    html.Div(id='relationship-status'),
     html.Div(id='relationship-plot', style={'textAlign': 'center', 'marginBottom': '40px'}),
     html.Div(id='analysis-plot', style={'textAlign': 'center'})  
 ])
 
-def plot_with_gradient(col, color1, color2):
-    plt.figure(figsize=(10, 6))
-
-    bars = sns.countplot(x=col, data=df, color=color1, edgecolor='black')
-    
-    for bar in bars.patches:
-        bar.set_facecolor(color1)
-        bar.set_edgecolor('black')
-        bar.set_linewidth(1.5)
-        bar.set_hatch('//')
-        
-        height = bar.get_height()
-        bars.annotate(f'{int(height)}',
-                      xy=(bar.get_x() + bar.get_width() / 2, height),
-                      xytext=(0, 3), 
-                      textcoords="offset points",
-                      ha='center', va='bottom', fontsize=12, color='black')
-
-    plt.title(f'Distribution of {col.capitalize()} Usage', fontsize=16)
-    plt.xlabel(f'{col.capitalize()} Usage', fontsize=14)
-    plt.ylabel('Frequency', fontsize=14)
-    plt.grid(True, linestyle='--', alpha=0.7)
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    plt.close()
-    buf.seek(0)
-    img_bytes = buf.getvalue()
-    buf.close()
-    
-    encoded_image = base64.b64encode(img_bytes).decode('utf-8')
-    return 'data:image/png;base64,{}'.format(encoded_image)
-
-@app.callback(
-    Output('drug1-plot', 'children'),
-    [Input('drug1-dropdown', 'value')]
-)
-def update_drug1_plot(selected_drug):
+def cohort_frame(cohort):
+    if not cohort:
+        return data.df
+    return data.df.take(data.cohorts.rows(cohort))
+
+def cohort_cube(cohort, drug1, drug2):
+    # The whole population's cube is precomputed; a cohort's is counted from its rows through the bitmap index.
+    if not cohort:
+        return data.cube
+    return data.cohorts.cube(cohort, [drug1, drug2])
+
+def cohort_is_empty(cohort):
+    return bool(cohort) and data.cohorts.count(cohort) == 0
+
+def plot_with_gradient(col, color1, color2, cohort=None):
+    with stage('countplot'):
+        fig = report.distribution_figure(cohort_frame(cohort), col, color1)
+    return encode_figure(fig)
+
+def plot_relationship(drug1, drug2, cohort=None):
+    return pair_jobs.relationship_image(cohort_frame(cohort), drug1, drug2)
+
+def plot_combination_analysis(drug1, drug2, cohort=None):
+    return pair_jobs.combination_image(cohort_cube(cohort, drug1, drug2), drug1, drug2)
+
+def bundled_image(name, cohort):
+    # Only the whole population is in the bundle; cohorts are always rendered live.
+    return None if cohort else bundle.image(name, data.version)
+
+def distribution_image(drug, cohort=None):
+    color1, color2 = drug_colors[drug]
+    return figure_cache.get_or_render(('distribution', drug, data.version, cohort_index.cohort_key(cohort)),
+                                      lambda: (bundled_image(f'distribution/{drug}', cohort) or
+                                               plot_with_gradient(drug, color1, color2, cohort)))
+
+def pair_cache_keys(drug1, drug2, version, cohort=None):
+    cohort_key = cohort_index.cohort_key(cohort)
+    return {'relationship': ('relationship', drug1, drug2, version, cohort_key),
+            'analysis': ('combination_stats', drug1, drug2, version, cohort_key)}
+
+def pair_bundle_names(drug1, drug2):
+    name = report.pair_name(drug1, drug2)
+    return {'relationship': f'relationship/{name}', 'analysis': f'combinations/{name}'}
+
+def relationship_images(drug1, drug2, cohort=None):
+    keys = pair_cache_keys(drug1, drug2, data.version, cohort)
+    names = pair_bundle_names(drug1, drug2)
+    relationship = figure_cache.get_or_render(keys['relationship'],
+                                              lambda: (bundled_image(names['relationship'], cohort) or
+                                                       plot_relationship(drug1, drug2, cohort)))
+    analysis = figure_cache.get_or_render(keys['analysis'],
+                                          lambda: (bundled_image(names['analysis'], cohort) or
+                                                   plot_combination_analysis(drug1, drug2, cohort)))
+    return relationship, analysis
+
+def cached_pair_images(drug1, drug2, version, cohort=None):
+    """The pair's images this process has cached (e.g. by warm_up_figures) or can read from the bundle."""
+    names = pair_bundle_names(drug1, drug2)
+    images = {}
+    for image, key in pair_cache_keys(drug1, drug2, version, cohort).items():
+        payload = figure_cache.get(key)
+        if payload is None:
+            payload = bundled_image(names[image], cohort)
+            if payload is not None:
+                figure_cache.put(key, payload)
+        if payload is not None:
+            images[image] = payload
+    return images
+
+def warm_up_figures():
+    """Render every single-drug and drug-pair figure into the cache."""
+    with timed('warm up figures'):
+        for drug in drug_colors:
+            distribution_image(drug)
+        for drug1, drug2 in itertools.permutations(drug_colors, 2):
+            relationship_images(drug1, drug2)
+
+
+def set_cohort_options(_):
+    cohorts = data.cohorts
+    options = []
+    for column in cohort_dropdowns:
+        labels = admission_types if column == 'admission_type_id' else {}
+        values = cohorts.values(column) if column in cohorts.columns else []
+        options.append([{'label': str(labels.get(value, value)), 'value': value} for value in values])
+    days = [value for value in cohorts.values('time_in_hospital') if not isinstance(value, str)]
+    return options + [min(days), max(days), {day: str(day) for day in days}, [min(days), max(days)]]
+
+def update_cohort(*values):
+    *selected, days = values
+    cohorts = data.cohorts
+    cohort = {column: value for column, value in zip(cohort_dropdowns, selected) if value}
+    all_days = [value for value in cohorts.values('time_in_hospital') if not isinstance(value, str)]
+    if days and (days[0] > min(all_days) or days[1] < max(all_days)):
+        cohort['time_in_hospital'] = days
+    size = cohorts.count(cohort)
+    return cohort or None, f'{size:,} of {cohorts.n_rows:,} encounters'
+
+def update_drug1_plot(selected_drug, cohort):
     if selected_drug is None:
         return None  
-    colors = {
-        'metformin': ('skyblue', 'dodgerblue'),
-        'glipizide': ('salmon', 'firebrick'),
-        'glyburide': ('lightgreen', 'forestgreen'),
-        'insulin': ('orange', 'darkorange'),
-        'repaglinide': ('purple', 'indigo'),
-        'nateglinide': ('red', 'darkred'),
-        'chlorpropamide': ('cyan', 'darkcyan'),
-        'glimepiride': ('magenta', 'darkmagenta'),
-        'acetohexamide': ('lime', 'green'),
-        'tolbutamide': ('brown', 'saddlebrown')
-        # 'readmitted': ('blue', 'navy'),
-        # 'diabetesMed': ('pink', 'deeppink')
-    }
-    color1, color2 = colors[selected_drug]
-    return html.Div(html.Img(src=plot_with_gradient(selected_drug, color1, color2)), style={'textAlign': 'center'})
-
-@app.callback(
-    [Output('drug2-dropdown', 'options'),
-     Output('drug2-dropdown', 'disabled'),
-     Output('relationship-button', 'disabled')],
-    [Input('drug1-dropdown', 'value')]
-)
+    if cohort_is_empty(cohort):
+        return html.Div('No encounters match the cohort filters.')
+    return html.Div(html.Img(src=distribution_image(selected_drug, cohort)), style={'textAlign': 'center'})
+
 def set_drug2_options(selected_drug1):
     if selected_drug1 is None:
         return [], True, True  
@@ -167,111 +281,125 @@ def set_drug2_options(selected_drug1):
         options = [opt for opt in options if opt['value'] != selected_drug1]
         return options, False, False  
 
-@app.callback(
-    Output('drug2-plot', 'children'),
-    [Input('drug2-dropdown', 'value')]
-)
-def update_drug2_plot(selected_drug):
+def update_drug2_plot(selected_drug, cohort):
     if selected_drug is None:
         return None  
-    colors = {
-        'metformin': ('skyblue', 'dodgerblue'),
-        'glipizide': ('salmon', 'firebrick'),
-        'glyburide': ('lightgreen', 'forestgreen'),
-        'insulin': ('orange', 'darkorange'),
-        'repaglinide': ('purple', 'indigo'),
-        'nateglinide': ('red', 'darkred'),
-        'chlorpropamide': ('cyan', 'darkcyan'),
-        'glimepiride': ('magenta', 'darkmagenta'),
-        'acetohexamide': ('lime', 'green'),
-        'tolbutamide': ('brown', 'saddlebrown')
-    }
-    color1, color2 = colors[selected_drug]
-    return html.Div(html.Img(src=plot_with_gradient(selected_drug, color1, color2)), style={'textAlign': 'center'})
-
-@app.callback(
-    [Output('relationship-plot', 'children'),
-     Output('analysis-plot', 'children')],
-    [Input('relationship-button', 'n_clicks'),
-     Input('drug1-dropdown', 'value'),
-     Input('drug2-dropdown', 'value')]
-)
-def handle_relationship_and_analysis(n_clicks, drug1, drug2):
+    if cohort_is_empty(cohort):
+        return html.Div('No encounters match the cohort filters.')
+    return html.Div(html.Img(src=distribution_image(selected_drug, cohort)), style={'textAlign': 'center'})
+
+def handle_relationship_and_analysis(n_clicks, drug1, drug2, cohort):
     ctx = dash.callback_context
 
     if ctx.triggered and ctx.triggered[0]['prop_id'] in ['drug1-dropdown.value', 'drug2-dropdown.value']:
-        return None, None
-
-    if n_clicks > 0 and drug1 and drug2:
-        def random_color():
-            return '#%06x' % random.randint(0, 0xFFFFFF)
-
-        plt.figure(figsize=(10, 6))
-        sns.lineplot(x=drug1, y=drug2, data=df, marker='o', color=random_color())
-        plt.title(f'Relationship between {drug1.capitalize()} and {drug2.capitalize()}', fontsize=16)
-        plt.xlabel(f'{drug1.capitalize()} Usage', fontsize=14)
-        plt.ylabel(f'{drug2.capitalize()} Usage', fontsize=14)
-        plt.grid(True, linestyle='--', alpha=0.7)
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        plt.close()
-        buf.seek(0)
-        img_bytes = buf.getvalue()
-        buf.close()
-        
-        relationship_plot = html.Div(html.Img(src='data:image/png;base64,{}'.format(base64.b64encode(img_bytes).decode('utf-8'))), style={'textAlign': 'center'})
-
-        df_filtered = df[df[drug1].notna() & df[drug2].notna()]
-        df_filtered[drug1] = df_filtered[drug1].astype(str)
-        df_filtered[drug2] = df_filtered[drug2].astype(str)
-        df_filtered['drug_combination'] = df_filtered[drug1] + ' & ' + df_filtered[drug2]
-        def calculate_percentage(group):
-            total = group['readmitted_mapped'].count()
-            percentages = group['readmitted_mapped'].value_counts(normalize=True) * 100
-            return percentages
-        combinations = df_filtered['drug_combination'].unique()
-        results = []
-
-        for combo in combinations:
-            subset = df_filtered[df_filtered['drug_combination'] == combo]
-            percentages = calculate_percentage(subset)
-            results.append({
-                'Combination': combo,
-                'Up': percentages.get('Up', 0),
-                'Down': percentages.get('Down', 0),
-                'No': percentages.get('No', 0)
-            })
-
-        results_df = pd.DataFrame(results).set_index('Combination')
-
-        plt.figure(figsize=(14, 8))
-
-        results_df_melted = results_df.reset_index().melt(id_vars='Combination', var_name='Status', value_name='Percentage')
-
-        colors = ['#%06x' % random.randint(0, 0xFFFFFF) for _ in range(results_df_melted['Status'].nunique())]
-
-        sns.barplot(data=results_df_melted, x='Combination', y='Percentage', hue='Status', palette=colors, edgecolor='black')
-
-        plt.xticks(rotation=90)
-        plt.xlabel('Medication Combination', fontsize=14)
-        plt.ylabel('Percentage (%)', fontsize=14)
-        plt.title(f'Percentage of Readmitted Status by Combination of {drug1.capitalize()} and {drug2.capitalize()}', fontsize=16)
-        plt.legend(title='Readmitted Status')
-        plt.grid(True, linestyle='--', alpha=0.7)
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        plt.close()
-        buf.seek(0)
-        img_bytes = buf.getvalue()
-        buf.close()
-        
-        analysis_plot = html.Div(html.Img(src='data:image/png;base64,{}'.format(base64.b64encode(img_bytes).decode('utf-8'))), style={'textAlign': 'center'})
-        
-        return relationship_plot, analysis_plot
-
-    return None, None
+        return None
+
+    # A changed cohort reruns the analysis shown, if any.
+    if n_clicks > 0 and drug1 and drug2 and not cohort_is_empty(cohort):
+        version = data.version
+        key = ('OLAP.relationship', drug1, drug2, version, cohort_index.cohort_key(cohort))
+        images = cached_pair_images(drug1, drug2, version, cohort)
+        if len(images) == 2:
+            return jobs.complete(key, images)
+
+        # The worker gets only what the missing images need, and hands them back for this process's cache.
+        frame = None if 'relationship' in images else cohort_frame(cohort)[[drug1, drug2]]
+        cube = None if 'analysis' in images else cohort_cube(cohort, drug1, drug2)
+        cache_keys = pair_cache_keys(drug1, drug2, version, cohort)
+
+        def cache_images(result):
+            for image, cache_key in cache_keys.items():
+                figure_cache.put(cache_key, result[image])
+
+        return jobs.submit(key, pair_jobs.pair_images, drug1, drug2, frame, cube, images, on_done=cache_images)
+
+    return None
+
+def poll_relationship_job(job, n_intervals):
+    if job is None:
+        return None, None, None, True
+
+    status = jobs.status(job)
+    if status is not None and status['state'] == DONE:
+        result = status['result']
+        relationship_plot = html.Div(html.Img(src=result['relationship']), style={'textAlign': 'center'})
+        analysis_plot = html.Div(html.Img(src=result['analysis']), style={'textAlign': 'center'})
+        return relationship_plot, analysis_plot, None, True
+
+    finished = status is None or status['state'] not in (QUEUED, RUNNING)
+    return None, None, progress_bar(status), finished
+
+def register_callbacks(app):
+    app.callback(
+        [Output(f'cohort-{column}', 'options') for column in cohort_dropdowns] +
+        [Output('cohort-time_in_hospital', 'min'),
+         Output('cohort-time_in_hospital', 'max'),
+         Output('cohort-time_in_hospital', 'marks'),
+         Output('cohort-time_in_hospital', 'value')],
+        [Input('cohort-panel', 'id')]
+    )(set_cohort_options)
+
+    app.callback(
+        [Output('cohort-filters', 'data'),
+         Output('cohort-size', 'children')],
+        [Input(f'cohort-{column}', 'value') for column in cohort_dropdowns] +
+        [Input('cohort-time_in_hospital', 'value')]
+    )(update_cohort)
+
+    app.callback(
+        Output('drug1-plot', 'children'),
+        [Input('drug1-dropdown', 'value'),
+         Input('cohort-filters', 'data')]
+    )(update_drug1_plot)
+
+    app.callback(
+        [Output('drug2-dropdown', 'options'),
+         Output('drug2-dropdown', 'disabled'),
+         Output('relationship-button', 'disabled')],
+        [Input('drug1-dropdown', 'value')]
+    )(set_drug2_options)
+
+    app.callback(
+        Output('drug2-plot', 'children'),
+        [Input('drug2-dropdown', 'value'),
+         Input('cohort-filters', 'data')]
+    )(update_drug2_plot)
+
+    app.callback(
+        Output('relationship-job', 'data'),
+        [Input('relationship-button', 'n_clicks'),
+         Input('drug1-dropdown', 'value'),
+         Input('drug2-dropdown', 'value'),
+         Input('cohort-filters', 'data')]
+    )(handle_relationship_and_analysis)
+
+    app.callback(
+        [Output('relationship-plot', 'children'),
+         Output('analysis-plot', 'children'),
+         Output('relationship-status', 'children'),
+         Output('relationship-poll', 'disabled')],
+        [Input('relationship-job', 'data'),
+         Input('relationship-poll', 'n_intervals')]
+    )(poll_relationship_job)
+
+def create_app(data_load=DATA_LOAD):
+    with timed('create app'):
+        app = dash.Dash(__name__)
+        instrument(app)
+        add_report_route(app.server)
+        add_bundle_route(app.server, bundle.path)
+        app.server.before_request(refresh_data)
+        app.layout = layout
+        register_callbacks(app)
+    if WARM_FIGURES:
+        data.on_ready(warm_up_figures)
+    data.start(data_load)
+    return app
+
+# Run as a script the debug reloader imports this module twice; the watching
+# parent never serves a request, so it does not need the data.
+app = create_app('lazy' if __name__ == '__main__' and not os.environ.get('WERKZEUG_RUN_MAIN') else DATA_LOAD)
+server = app.server
 
 if __name__ == '__main__':
     app.run_server(debug=True, port=8052)
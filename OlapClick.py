@@ -1,23 +1,46 @@
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output, State
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from sklearn.preprocessing import LabelEncoder
-
-df = pd.read_csv('D:/diabetes+130-us+hospitals+for+years+1999-2008/cleaned_diabetic_data_with_Median.csv')
-
-readmitted_mapping = {
-    '>30': 'Up',
-    '<30': 'Down',
-    'NO': 'No'
-}
-df['readmitted_mapped'] = df['readmitted'].map(readmitted_mapping)
-
-app = dash.Dash(__name__)
-app.layout = html.Div([
+import os
+
+import pair_jobs
+from job_queue import DONE, QUEUED, RUNNING, JobQueue, progress_bar
+from metrics import instrument, stage
+from report import Bundle, add_bundle_route
+from startup import DATA_LOAD, LazyDataset, add_report_route, lazy_import, timed
+
+with timed('import dash'):
+    import dash
+    import dash_core_components as dcc
+    import dash_html_components as html
+    from dash.dependencies import Input, Output
+
+# Figure and analysis libraries are imported by the first callback that needs
+# them, so a new worker (or a reloaded debug server) answers requests without them.
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+px = lazy_import('plotly.express')
+go = lazy_import('plotly.graph_objects')
+combination_stats = lazy_import('combination_stats')
+drug_cube = lazy_import('drug_cube')
+
+
+def load_data():
+    with timed('import ingest'):
+        from ingest import LiveDataset
+    return LiveDataset()
+
+
+# Follows batches appended with ingest.py; loaded in the background or on first use (DASH_DATA_LOAD).
+data = LazyDataset(load_data, 'OlapClick data')
+
+def refresh_data(force=False):
+    data.refresh(force)
+
+# The relationship analysis runs in a process pool so the request thread returns at once.
+jobs = JobQueue()
+
+# Combination statistics precomputed by report.py (DIABETES_REPORT_DIR), used when they match the data.
+bundle = Bundle()
+
+layout = html.Div([
     html.H1("Medication Combination Effectiveness", style={'textAlign': 'center', 'marginBottom': '30px'}),
 
     html.Div([
@@ -70,34 +93,66 @@ app.layout = html.Div([
                     })
     ]),
 
+    dcc.Store(id='relationship-job'),
+    dcc.Interval(id='relationship-poll', interval=500, disabled=True),
+    html.Div(id='relationship-status'),
     html.Div(id='relationship-plot', style={'textAlign': 'center', 'marginBottom': '40px'}),
     html.Div(id='analysis-plot', style={'textAlign': 'center', 'marginBottom': '40px'}),
     html.Div(id='summary-statistics', style={'textAlign': 'center', 'marginBottom': '40px'}),
-    html.Div(id='correlation-matrix', style={'textAlign': 'center', 'marginBottom': '40px'})
+    html.Div(id='correlation-matrix', style={'textAlign': 'center', 'marginBottom': '40px'}),
+
+    html.Div([
+        html.H2("Top Medication Combinations", style={'textAlign': 'center'}),
+        html.Label("Number of Combinations:", style={'fontSize': '16px', 'fontWeight': 'bold'}),
+        dcc.Slider(id='top-n-slider', min=5, max=50, step=5, value=10),
+        dcc.RadioItems(
+            id='top-sort',
+            options=[
+                {'label': 'Most Common', 'value': 'Support'},
+                {'label': 'Highest Readmission', 'value': 'Readmitted'},
+                {'label': 'Lowest Readmission', 'value': 'No'}
+            ],
+            value='Support',
+            labelStyle={'display': 'inline-block', 'marginRight': '15px'},
+            style={'marginTop': '10px'}
+        ),
+        html.Label("Minimum Patients per Combination:", style={'fontSize': '16px', 'fontWeight': 'bold', 'marginRight': '10px'}),
+        dcc.Input(id='min-support-input', type='number', min=1, value=20),
+        html.Div(id='top-combinations-plot', style={'marginTop': '20px'})
+    ], style={'width': '80%', 'margin': '0 auto', 'textAlign': 'center', 'marginBottom': '40px'}),
+
+    html.Div([
+        html.H2("Associations between Medications and Readmission", style={'textAlign': 'center'}),
+        dcc.RadioItems(
+            id='association-measure',
+            options=[
+                {'label': 'Correlation (label codes)', 'value': 'pearson'},
+                {'label': "Cramér's V", 'value': 'cramers_v'}
+            ],
+            value='pearson',
+            labelStyle={'display': 'inline-block', 'marginRight': '15px'}
+        ),
+        html.Div(id='association-heatmap', style={'marginTop': '20px'})
+    ], style={'width': '80%', 'margin': '0 auto', 'textAlign': 'center', 'marginBottom': '40px'})
 ])
 
-@app.callback(
-    Output('drug1-plot', 'children'),
-    [Input('drug1-dropdown', 'value')]
-)
+def usage_distribution_figure(drug):
+    # Bars are built from the cube's level counts so only four numbers are sent to the browser.
+    counts = pd.DataFrame({drug: drug_cube.USAGE_LEVELS, 'count': data.cube.level_totals[drug]})
+    counts = counts[counts['count'] > 0]
+    fig = px.bar(counts, x=drug, y='count', color=drug,
+                 title=f"Distribution of {drug.capitalize()} Usage",
+                 labels={drug: f"{drug.capitalize()} Usage"},
+                 template="plotly_dark")
+    fig.update_layout(bargap=0.2)
+    return fig
+
 def update_drug1_plot(selected_drug):
     if selected_drug is None:
         return None  
 
-    fig = px.histogram(df, x=selected_drug, color=selected_drug,
-                       title=f"Distribution of {selected_drug.capitalize()} Usage",
-                       labels={selected_drug: f"{selected_drug.capitalize()} Usage"},
-                       template="plotly_dark")
-    fig.update_layout(bargap=0.2)
-
-    return dcc.Graph(figure=fig)
+    return dcc.Graph(figure=usage_distribution_figure(selected_drug))
 
-@app.callback(
-    [Output('drug2-dropdown', 'options'),
-     Output('drug2-dropdown', 'disabled'),
-     Output('relationship-button', 'disabled')],
-    [Input('drug1-dropdown', 'value')]
-)
 def set_drug2_options(selected_drug1):
     if selected_drug1 is None:
         return [], True, True  
@@ -118,135 +173,142 @@ def set_drug2_options(selected_drug1):
         options = [opt for opt in options if opt['value'] != selected_drug1]
         return options, False, False  
 
-@app.callback(
-    Output('drug2-plot', 'children'),
-    [Input('drug2-dropdown', 'value')]
-)
 def update_drug2_plot(selected_drug):
     if selected_drug is None:
         return None  
 
-    fig = px.histogram(df, x=selected_drug, color=selected_drug,
-                       title=f"Distribution of {selected_drug.capitalize()} Usage",
-                       labels={selected_drug: f"{selected_drug.capitalize()} Usage"},
-                       template="plotly_dark")
-    fig.update_layout(bargap=0.2)
+    return dcc.Graph(figure=usage_distribution_figure(selected_drug))
 
-    return dcc.Graph(figure=fig)
-
-@app.callback(
-    [Output('relationship-plot', 'children'),
-     Output('analysis-plot', 'children'),
-     Output('summary-statistics', 'children'),
-     Output('correlation-matrix', 'children')],
-    [Input('relationship-button', 'n_clicks'),
-     Input('drug1-dropdown', 'value'),
-     Input('drug2-dropdown', 'value')]
-)
 def handle_relationship_and_analysis(n_clicks, drug1, drug2):
     ctx = dash.callback_context
 
     if ctx.triggered and ctx.triggered[0]['prop_id'] in ['drug1-dropdown.value', 'drug2-dropdown.value']:
-        return None, None, None, None
+        return None
 
     if n_clicks > 0 and drug1 and drug2:
-        # Generate the violin plot
-        fig1 = px.violin(df, x=drug1, y=drug2, 
-                          title=f'Violin Plot of {drug2.capitalize()} across {drug1.capitalize()} Levels',
-                          labels={drug1: f'{drug1.capitalize()} Usage', drug2: f'{drug2.capitalize()} Usage'},
-                          template="plotly_dark")
-        fig1.update_traces(box_visible=True, meanline_visible=True)
-        relationship_plot = dcc.Graph(figure=fig1)
-
-        # Analysis plot
-        df_filtered = df[df[drug1].notna() & df[drug2].notna()]
-        df_filtered[drug1] = df_filtered[drug1].astype(str)
-        df_filtered[drug2] = df_filtered[drug2].astype(str)
-        df_filtered['drug_combination'] = df_filtered[drug1] + ' & ' + df_filtered[drug2]
-
-        def calculate_percentage(group):
-            total = group['readmitted_mapped'].count()
-            percentages = group['readmitted_mapped'].value_counts(normalize=True) * 100
-            return percentages
-
-        combinations = df_filtered['drug_combination'].unique()
-        results = []
-
-        for combo in combinations:
-            subset = df_filtered[df_filtered['drug_combination'] == combo]
-            percentages = calculate_percentage(subset)
-            results.append({
-                'Combination': combo,
-                'Up': percentages.get('Up', 0),
-                'Down': percentages.get('Down', 0),
-                'No': percentages.get('No', 0)
-            })
-
-        results_df = pd.DataFrame(results).set_index('Combination')
-
-        fig2 = go.Figure()
-
-        for status in results_df.columns:
-            fig2.add_trace(go.Bar(
-                x=results_df.index,
-                y=results_df[status],
-                name=status
-            ))
-
-        fig2.update_layout(barmode='stack',
-                           title=f'Percentage of Readmitted Status by Combination of {drug1.capitalize()} and {drug2.capitalize()}',
-                           xaxis_title='Medication Combination',
-                           yaxis_title='Percentage (%)',
-                           template="plotly_dark")
-
-        analysis_plot = dcc.Graph(figure=fig2)
-
-        # Detailed Summary Statistics
-        summary_stats = {
-            "Statistic": ["Mode", "No", "Up", "Steady", "Down", "Count"],
-            drug1.capitalize(): [
-                df[drug1].mode()[0] if not df[drug1].mode().empty else None,
-                df_filtered[drug1].value_counts().get("No", 0),
-                df_filtered[drug1].value_counts().get("Up", 0),
-                df_filtered[drug1].value_counts().get("Steady", 0),
-                df_filtered[drug1].value_counts().get("Down", 0),
-                df_filtered[drug1].count()
-            ],
-            drug2.capitalize(): [
-                df[drug2].mode()[0] if not df[drug2].mode().empty else None,
-                df_filtered[drug2].value_counts().get("No", 0),
-                df_filtered[drug2].value_counts().get("Up", 0),
-                df_filtered[drug2].value_counts().get("Steady", 0),
-                df_filtered[drug2].value_counts().get("Down", 0),
-                df_filtered[drug2].count()
-            ]
-        }
-        summary_stats_df = pd.DataFrame(summary_stats)
-
-        summary_stats_fig = go.Figure(data=[go.Table(
-            header=dict(values=list(summary_stats_df.columns),
-                        fill_color='paleturquoise',
-                        align='left'),
-            cells=dict(values=[summary_stats_df[col] for col in summary_stats_df.columns],
-                       fill_color='lavender',
-                       align='left'))
-        ])
-        summary_stats_fig.update_layout(title_text='Detailed Summary Statistics')
-        summary_statistics = dcc.Graph(figure=summary_stats_fig)
-
-        le = LabelEncoder()
-        df_encoded = df[[drug1, drug2]].apply(le.fit_transform)
-
-        # Correlation Matrix
-        corr_matrix = df_encoded.corr()
-        corr_matrix_fig = px.imshow(corr_matrix, text_auto=True, aspect='auto', color_continuous_scale='Viridis',
-                                    title=f'Correlation Matrix between {drug1.capitalize()} and {drug2.capitalize()}',
-                                    labels={'color': 'Correlation'})
-        correlation_matrix = dcc.Graph(figure=corr_matrix_fig)
-
-        return relationship_plot, analysis_plot, summary_statistics, correlation_matrix
-
-    return None, None, None, None
+        version = data.version
+        # The worker gets the cube and the pair's slice of the correlation matrix, not the dataset.
+        return jobs.submit(('OlapClick.relationship', drug1, drug2, version), pair_jobs.pair_details, drug1, drug2,
+                           data.cube, data.associations.pair(drug1, drug2), bundle.path, version)
+
+    return None
+
+def poll_relationship_job(job, n_intervals):
+    if job is None:
+        return None, None, None, None, None, True
+
+    status = jobs.status(job)
+    if status is not None and status['state'] == DONE:
+        result = status['result']
+        relationship_plot = dcc.Graph(figure=result['relationship'])
+        analysis_plot = dcc.Graph(figure=result['analysis'])
+        summary_statistics = dcc.Graph(figure=result['summary'])
+        correlation_matrix = dcc.Graph(figure=result['correlation'])
+        return relationship_plot, analysis_plot, summary_statistics, correlation_matrix, None, True
+
+    finished = status is None or status['state'] not in (QUEUED, RUNNING)
+    return None, None, None, None, progress_bar(status), finished
+
+def update_top_combinations(top_n, sort_by, min_support):
+    with stage('top_combinations'):
+        top = data.profile.top(top_n, sort_by=sort_by, min_support=min_support or 1)
+    with stage('combination_statistics'):
+        counts = data.profile.combination_counts(top['Code'].to_numpy())
+        statistics = combination_stats.combination_statistics(counts)
+
+    fig = go.Figure()
+    for status in drug_cube.READMITTED_STATUSES:
+        fig.add_trace(go.Bar(
+            x=top['Combination'],
+            y=top[status],
+            name=status,
+            customdata=np.column_stack([top['Support'], statistics[f'{status} low'], statistics[f'{status} high']]),
+            hovertemplate='%{x}<br>%{y:.1f}% of %{customdata[0]} patients '
+                          '(95% CI %{customdata[1]:.1f}-%{customdata[2]:.1f})'
+        ))
+
+    fig.update_layout(barmode='stack',
+                      title=f'Readmitted Status of the Top {len(top)} Full Medication Combinations',
+                      xaxis_title='Medication Combination',
+                      yaxis_title='Percentage (%)',
+                      template="plotly_dark")
+
+    return dcc.Graph(figure=fig)
+
+def update_association_heatmap(measure):
+    matrix = data.associations.measure(measure)
+    title = 'Correlation of Label-Encoded Usage' if measure == 'pearson' else "Cramér's V of Usage Levels"
+    fig = px.imshow(matrix, text_auto='.2f', aspect='auto',
+                    color_continuous_scale='RdBu_r' if measure == 'pearson' else 'Viridis',
+                    zmin=-1 if measure == 'pearson' else 0, zmax=1,
+                    title=title, labels={'color': title})
+    fig.update_layout(height=800, template="plotly_dark")
+    return dcc.Graph(figure=fig)
+
+def register_callbacks(app):
+    app.callback(
+        Output('drug1-plot', 'children'),
+        [Input('drug1-dropdown', 'value')]
+    )(update_drug1_plot)
+
+    app.callback(
+        [Output('drug2-dropdown', 'options'),
+         Output('drug2-dropdown', 'disabled'),
+         Output('relationship-button', 'disabled')],
+        [Input('drug1-dropdown', 'value')]
+    )(set_drug2_options)
+
+    app.callback(
+        Output('drug2-plot', 'children'),
+        [Input('drug2-dropdown', 'value')]
+    )(update_drug2_plot)
+
+    app.callback(
+        Output('relationship-job', 'data'),
+        [Input('relationship-button', 'n_clicks'),
+         Input('drug1-dropdown', 'value'),
+         Input('drug2-dropdown', 'value')]
+    )(handle_relationship_and_analysis)
+
+    app.callback(
+        [Output('relationship-plot', 'children'),
+         Output('analysis-plot', 'children'),
+         Output('summary-statistics', 'children'),
+         Output('correlation-matrix', 'children'),
+         Output('relationship-status', 'children'),
+         Output('relationship-poll', 'disabled')],
+        [Input('relationship-job', 'data'),
+         Input('relationship-poll', 'n_intervals')]
+    )(poll_relationship_job)
+
+    app.callback(
+        Output('top-combinations-plot', 'children'),
+        [Input('top-n-slider', 'value'),
+         Input('top-sort', 'value'),
+         Input('min-support-input', 'value')]
+    )(update_top_combinations)
+
+    app.callback(
+        Output('association-heatmap', 'children'),
+        [Input('association-measure', 'value')]
+    )(update_association_heatmap)
+
+def create_app(data_load=DATA_LOAD):
+    with timed('create app'):
+        app = dash.Dash(__name__)
+        instrument(app)
+        add_report_route(app.server)
+        add_bundle_route(app.server, bundle.path)
+        app.server.before_request(refresh_data)
+        app.layout = layout
+        register_callbacks(app)
+    data.start(data_load)
+    return app
+
+# Run as a script the debug reloader imports this module twice; the watching
+# parent never serves a request, so it does not need the data.
+app = create_app('lazy' if __name__ == '__main__' and not os.environ.get('WERKZEUG_RUN_MAIN') else DATA_LOAD)
+server = app.server
 
 if __name__ == '__main__':
     app.run_server(debug=True, port=8054)
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from medication_codes import ALL_MEDICATIONS, LABEL_ORDER, VersionedCache, medication_codes
+
+ASSOCIATION_COLUMNS = ALL_MEDICATIONS + ['readmitted']
+
+CHUNK_ROWS = 65536
+
+_cache = VersionedCache()
+
+
+def label_codes(series):
+    """Integer codes of a column as LabelEncoder would assign them (sorted distinct values), -1 for missing,
+    together with the levels they stand for."""
+    codes, levels = pd.factorize(series, sort=True)
+    return codes, list(levels)
+
+
+def contingency_matrix(codes, n_levels, chunk_rows=CHUNK_ROWS):
+    """Every pairwise contingency table at once: one-hot rows multiplied by themselves.
+
+    Block (i, j) of the result, rows ``offsets[i]:offsets[i + 1]`` and columns
+    ``offsets[j]:offsets[j + 1]``, counts the level combinations of columns i and j.
+    """
+    offsets = np.concatenate([[0], np.cumsum(n_levels)]).astype(np.int64)
+    width = offsets[-1]
+    table = np.zeros((width, width), dtype=np.int64)
+    for start in range(0, len(codes), chunk_rows):
+        chunk = codes[start:start + chunk_rows]
+        one_hot = np.zeros((len(chunk), width), dtype=np.float32)
+        rows, columns = np.nonzero(chunk >= 0)
+        one_hot[rows, offsets[columns] + chunk[rows, columns]] = 1
+        # float32 products are exact while a chunk has fewer than 2**24 rows.
+        table += (one_hot.T @ one_hot).astype(np.int64)
+    return table, offsets
+
+
+def chi_square(observed):
+    """Chi-square statistic, degrees of freedom, p-value and Cramér's V of one contingency table."""
+    observed = observed[observed.sum(axis=1) > 0][:, observed.sum(axis=0) > 0]
+    n = observed.sum()
+    r, c = observed.shape
+    if n == 0 or r < 2 or c < 2:
+        return 0.0, 0, 1.0, 0.0
+    expected = np.outer(observed.sum(axis=1), observed.sum(axis=0)) / n
+    statistic = ((observed - expected) ** 2 / expected).sum()
+    dof = (r - 1) * (c - 1)
+    return statistic, dof, stats.chi2.sf(statistic, dof), np.sqrt(statistic / (n * (min(r, c) - 1)))
+
+
+def pearson(observed, x, y):
+    """Correlation of the values ``x`` (rows) and ``y`` (columns) weighted by a contingency table."""
+    n = observed.sum()
+    rows, columns = observed.sum(axis=1), observed.sum(axis=0)
+    sx, sy = x @ rows, y @ columns
+    covariance = x @ observed @ y - sx * sy / n
+    variance = (x ** 2 @ rows - sx ** 2 / n) * (y ** 2 @ columns - sy ** 2 / n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return covariance / np.sqrt(variance)
+
+
+class PairCounts:
+    """Contingency tables of every pair of columns, stored as one block matrix.
+
+    These counts are all the association measures need, and counts from
+    different row batches add up, so new data can be merged in without
+    revisiting old rows.
+    """
+
+    def __init__(self, columns, levels, table):
+        self.columns = list(columns)
+        self.levels = [list(column_levels) for column_levels in levels]
+        self.table = table
+        self.offsets = np.concatenate([[0], np.cumsum([len(column_levels) for column_levels in self.levels])])
+
+    def block(self, i, j):
+        return self.table[self.offsets[i]:self.offsets[i + 1], self.offsets[j]:self.offsets[j + 1]]
+
+    def merge(self, other):
+        """Counts over the rows of both; levels missing from one side count zero there."""
+        if other.columns != self.columns:
+            raise ValueError('Cannot merge pair counts of different columns')
+        levels = [sorted(set(mine) | set(theirs)) for mine, theirs in zip(self.levels, other.levels)]
+        merged = PairCounts(self.columns, levels, None)
+        merged.table = np.zeros((merged.offsets[-1], merged.offsets[-1]), dtype=np.int64)
+        for counts in (self, other):
+            positions = np.concatenate([
+                merged.offsets[i] + np.searchsorted(levels[i], column_levels)
+                for i, column_levels in enumerate(counts.levels)
+            ]).astype(np.int64)
+            merged.table[np.ix_(positions, positions)] += counts.table
+        return merged
+
+
+def count_pairs(df, columns=None, chunk_rows=CHUNK_ROWS):
+    """Pair counts of ``columns``; medication columns use the shared code matrix with all four usage levels."""
+    columns = [column for column in (columns or ASSOCIATION_COLUMNS) if column in df.columns]
+    medications = medication_codes(df)
+    encoded = [(medications.label(column), LABEL_ORDER) if column in medications.columns else label_codes(df[column])
+               for column in columns]
+    codes = np.column_stack([column_codes for column_codes, _ in encoded])
+    levels = [column_levels for _, column_levels in encoded]
+    table, _ = contingency_matrix(codes, [len(column_levels) for column_levels in levels], chunk_rows)
+    return PairCounts(columns, levels, table)
+
+
+class AssociationMatrix:
+    """Pairwise associations between coded columns.
+
+    ``pearson`` is the correlation of LabelEncoder codes (what OlapClick and the
+    notebooks used to compute one pair at a time); ``cramers_v``, ``chi2``,
+    ``p_value`` and ``dof`` come from the pairwise contingency tables and do not
+    depend on how the levels are ordered.
+    """
+
+    def __init__(self, columns, pearson, chi2, dof, p_value, cramers_v, n):
+        frame = lambda values: pd.DataFrame(values, index=columns, columns=columns)
+        self.columns = list(columns)
+        self.pearson = frame(pearson)
+        self.chi2 = frame(chi2)
+        self.dof = frame(dof)
+        self.p_value = frame(p_value)
+        self.cramers_v = frame(cramers_v)
+        self.n = frame(n)
+
+    @classmethod
+    def from_counts(cls, counts):
+        k = len(counts.columns)
+        # LabelEncoder numbers the levels a column actually takes 0, 1, 2, ...
+        codes = []
+        for i in range(k):
+            present = np.diag(counts.block(i, i)) > 0
+            codes.append(np.where(present, np.cumsum(present) - 1, 0).astype(np.float64))
+
+        results = {name: np.zeros((k, k)) for name in ('pearson', 'chi2', 'dof', 'p_value', 'cramers_v', 'n')}
+        for i in range(k):
+            for j in range(i, k):
+                block = counts.block(i, j)
+                values = (pearson(block, codes[i], codes[j]), *chi_square(block), block.sum())
+                for name, value in zip(('pearson', 'chi2', 'dof', 'p_value', 'cramers_v', 'n'), values):
+                    results[name][i, j] = results[name][j, i] = value
+        results['dof'] = results['dof'].astype(np.int64)
+        results['n'] = results['n'].astype(np.int64)
+        return cls(counts.columns, **results)
+
+    def measure(self, name):
+        return getattr(self, name)
+
+    def pair(self, drug1, drug2, measure='pearson'):
+        """2x2 slice for two columns, e.g. the correlation matrix OlapClick shows for a drug pair."""
+        return self.measure(measure).loc[[drug1, drug2], [drug1, drug2]]
+
+
+def compute_associations(df, columns=None, chunk_rows=CHUNK_ROWS):
+    return AssociationMatrix.from_counts(count_pairs(df, columns, chunk_rows))
+
+
+def association_matrix(df, columns=None):
+    """compute_associations cached per frame, dataset version and column list."""
+    return _cache.get(df, lambda: compute_associations(df, columns), tuple(columns or ASSOCIATION_COLUMNS))
@@ -0,0 +1,321 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from drug_cube import ALL_MEDICATIONS, MEDICATIONS, USAGE_LEVELS
+
+# Approximate No/Steady/Up/Down shares from the real data; everything else is almost always 'No'.
+USAGE_SHARES = {
+    'metformin': [0.80, 0.18, 0.01, 0.01],
+    'insulin': [0.47, 0.30, 0.11, 0.12],
+    'glipizide': [0.87, 0.11, 0.01, 0.01],
+    'glyburide': [0.90, 0.09, 0.005, 0.005],
+    'glimepiride': [0.95, 0.046, 0.002, 0.002],
+    'pioglitazone': [0.93, 0.068, 0.001, 0.001],
+    'rosiglitazone': [0.94, 0.058, 0.001, 0.001],
+    'repaglinide': [0.985, 0.014, 0.0005, 0.0005],
+    'nateglinide': [0.993, 0.0066, 0.0002, 0.0002],
+}
+RARE_USAGE_SHARES = [0.998, 0.0018, 0.0001, 0.0001]
+
+BENCHMARKS = ['csv_load', 'cleaning', 'cache', 'aggregation', 'cohort', 'render', 'svm']
+
+
+def generate_chunk(n_rows, rng, start_id=0):
+    """Random rows with the columns, value domains and rough distributions of diabetic_data.csv."""
+    data = {
+        'encounter_id': np.arange(start_id, start_id + n_rows) * 3 + 2278392,
+        'patient_nbr': rng.integers(135, 189502982, n_rows),
+        'race': rng.choice(['Caucasian', 'AfricanAmerican', '?', 'Hispanic', 'Other', 'Asian'], n_rows,
+                           p=[0.75, 0.19, 0.02, 0.02, 0.015, 0.005]),
+        'gender': rng.choice(['Female', 'Male'], n_rows, p=[0.54, 0.46]),
+        'age': rng.choice([f'[{low}-{low + 10})' for low in range(0, 100, 10)], n_rows,
+                          p=[0.002, 0.007, 0.016, 0.037, 0.095, 0.17, 0.22, 0.256, 0.169, 0.028]),
+        'weight': rng.choice(['?', '[75-100)', '[50-75)', '[100-125)'], n_rows, p=[0.97, 0.013, 0.009, 0.008]),
+        'admission_type_id': rng.integers(1, 9, n_rows),
+        'discharge_disposition_id': rng.integers(1, 29, n_rows),
+        'admission_source_id': rng.integers(1, 26, n_rows),
+        'time_in_hospital': rng.integers(1, 15, n_rows),
+        'payer_code': rng.choice(['?', 'MC', 'HM', 'SP', 'BC'], n_rows, p=[0.4, 0.32, 0.12, 0.08, 0.08]),
+        'medical_specialty': rng.choice(['?', 'InternalMedicine', 'Emergency/Trauma', 'Family/GeneralPractice',
+                                         'Cardiology'], n_rows, p=[0.49, 0.15, 0.14, 0.12, 0.1]),
+        'num_lab_procedures': rng.integers(1, 133, n_rows),
+        'num_procedures': rng.integers(0, 7, n_rows),
+        'num_medications': rng.integers(1, 82, n_rows),
+        'number_outpatient': rng.poisson(0.37, n_rows),
+        'number_emergency': rng.poisson(0.2, n_rows),
+        'number_inpatient': rng.poisson(0.64, n_rows),
+    }
+    for column in ['diag_1', 'diag_2', 'diag_3']:
+        codes = rng.integers(1, 1000, n_rows).astype(str).astype(object)
+        kind = rng.random(n_rows)
+        codes[kind < 0.01] = '?'
+        v_rows = (kind >= 0.01) & (kind < 0.04)
+        codes[v_rows] = ['V' + str(code) for code in rng.integers(10, 90, v_rows.sum())]
+        e_rows = (kind >= 0.04) & (kind < 0.05)
+        codes[e_rows] = ['E' + str(code) for code in rng.integers(800, 1000, e_rows.sum())]
+        data[column] = codes
+    data['number_diagnoses'] = rng.integers(1, 17, n_rows)
+    data['max_glu_serum'] = rng.choice(['None', 'Norm', '>200', '>300'], n_rows, p=[0.95, 0.025, 0.015, 0.01])
+    data['A1Cresult'] = rng.choice(['None', '>8', 'Norm', '>7'], n_rows, p=[0.83, 0.08, 0.05, 0.04])
+    for drug in ALL_MEDICATIONS:
+        data[drug] = rng.choice(USAGE_LEVELS, n_rows, p=USAGE_SHARES.get(drug, RARE_USAGE_SHARES))
+    data['change'] = rng.choice(['No', 'Ch'], n_rows, p=[0.54, 0.46])
+    data['diabetesMed'] = rng.choice(['Yes', 'No'], n_rows, p=[0.77, 0.23])
+    data['readmitted'] = rng.choice(['NO', '>30', '<30'], n_rows, p=[0.54, 0.35, 0.11])
+    return pd.DataFrame(data)
+
+
+def write_synthetic_csv(path, n_rows, seed=0, chunksize=500_000):
+    """Write ``n_rows`` synthetic rows in chunks; the same seed always produces the same file."""
+    for index, start in enumerate(range(0, n_rows, chunksize)):
+        rng = np.random.default_rng([seed, index])
+        chunk = generate_chunk(min(chunksize, n_rows - start), rng, start)
+        chunk.to_csv(path, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+
+
+def timed(func, repeat=1):
+    """Run ``func`` ``repeat`` times; returns the best wall time and the last result."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - start)
+    return {'seconds': min(runs), 'runs': runs}, result
+
+
+def bench_csv_load(raw_path, repeat):
+    stats, df = timed(lambda: pd.read_csv(raw_path), repeat)
+    stats['rows_per_sec'] = len(df) / stats['seconds']
+    return stats
+
+
+def bench_cleaning(raw_path, cleaned_path, repeat):
+    from cleaning import run_pipeline
+
+    stats, report = timed(lambda: run_pipeline(raw_path, cleaned_path), repeat)
+    stats['rows_per_sec'] = report['rows'] / stats['seconds']
+    stats['stages'] = report['timings']
+    return stats
+
+
+def bench_cache(cleaned_path, repeat):
+    from dataset import build_cache, load_dataset
+
+    build, _ = timed(lambda: build_cache(cleaned_path), repeat)
+    load, df = timed(lambda: load_dataset(cleaned_path), repeat)
+    return {'build': build, 'load': load}, df
+
+
+def bench_aggregation(df, repeat):
+    """Cube build plus every drug-pair query handle_relationship_and_analysis issues."""
+    from associations import compute_associations
+    from drug_cube import build_cube
+
+    build, cube = timed(lambda: build_cube(df), repeat)
+
+    def query_all_pairs():
+        for drug1, drug2 in itertools.permutations(MEDICATIONS, 2):
+            cube.combination_percentages(drug1, drug2)
+            cube.distribution_summary(drug1, drug2)
+            cube.level_counts(drug1, drug2)
+
+    pairs, _ = timed(query_all_pairs, repeat)
+    n_pairs = len(MEDICATIONS) * (len(MEDICATIONS) - 1)
+    pairs['per_pair_ms'] = pairs['seconds'] / n_pairs * 1000
+    associations, _ = timed(lambda: compute_associations(df), repeat)
+    return {'build_cube': build, 'pair_queries': pairs, 'associations': associations}
+
+
+def bench_cohort(df, repeat):
+    """Cohort index build, and filtered combination statistics of one drug pair as the OLAP drill-down runs them."""
+    from cohort_index import CohortIndex
+    from combination_stats import pair_statistics
+
+    build, index = timed(lambda: CohortIndex.from_frame(df), repeat)
+    cohorts = {
+        'one_filter': {'admission_type_id': [1]},
+        'compound': {'age': ['[70-80)', '[80-90)'], 'gender': ['Female'], 'A1Cresult': ['>8', 'None'],
+                     'time_in_hospital': [3, 7]},
+    }
+    results = {'build': build, 'index_mb': index.nbytes / 1e6}
+    for name, cohort in cohorts.items():
+        stats, _ = timed(lambda: pair_statistics(index.cube(cohort, ['metformin', 'insulin']), 'metformin', 'insulin'),
+                         repeat)
+        stats['rows'] = index.count(cohort)
+        results[name] = stats
+    return results
+
+
+def bench_render(repeat):
+    # OLAP loads the dataset from DIABETES_DATA_DIR, which run_scale points at the benchmark data.
+    import OLAP
+
+    OLAP.data.get()
+
+    def render_all():
+        return [OLAP.plot_with_gradient(drug, *OLAP.drug_colors[drug]) for drug in MEDICATIONS]
+
+    stats, images = timed(render_all, repeat)
+    stats['per_figure_ms'] = stats['seconds'] / len(MEDICATIONS) * 1000
+    stats['mean_image_bytes'] = int(np.mean([len(image) for image in images]))
+    return stats
+
+
+def bench_svm(df, repeat, svm_rows, seed):
+    """The model.ipynb setup: one-hot medications -> readmitted, 70/30 split."""
+    from sklearn.model_selection import train_test_split
+    from sklearn.svm import SVC
+
+    from linear_svm import DedupLinearSVM
+
+    X = pd.get_dummies(df[MEDICATIONS].astype(str), drop_first=True)
+    y = df['readmitted'].astype(str)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42)
+
+    results = {}
+    fit, model = timed(lambda: DedupLinearSVM().fit(X_train, y_train), repeat)
+    predict, _ = timed(lambda: model.predict(X_test), repeat)
+    results['dedup_linear'] = {'fit': fit, 'predict': predict, 'train_rows': len(X_train)}
+
+    # libsvm scales quadratically, so SVC is measured on a fixed-size subsample.
+    sample = X_train.sample(min(svm_rows, len(X_train)), random_state=seed).index
+    fit, model = timed(lambda: SVC(kernel='linear').fit(X_train.loc[sample], y_train.loc[sample]), repeat)
+    predict, _ = timed(lambda: model.predict(X_test.iloc[:svm_rows]), repeat)
+    results['svc_linear'] = {'fit': fit, 'predict': predict, 'train_rows': len(sample)}
+    return results
+
+
+def flatten_seconds(result, prefix=''):
+    """Map 'cleaning', 'svm.dedup_linear.fit', ... to their best time in seconds."""
+    timings = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            if 'seconds' in value:
+                timings[prefix + key] = value['seconds']
+            timings.update(flatten_seconds(value, f'{prefix}{key}.'))
+    return timings
+
+
+def compare_reports(baseline, report):
+    """Ratio of new to baseline time for every measurement present in both reports."""
+    baseline_results = {result['rows']: flatten_seconds(result) for result in baseline['results']}
+    comparison = []
+    for result in report['results']:
+        old = baseline_results.get(result['rows'], {})
+        for name, seconds in flatten_seconds(result).items():
+            if name in old and old[name] > 0:
+                comparison.append({'rows': result['rows'], 'benchmark': name, 'baseline': old[name],
+                                   'current': seconds, 'ratio': seconds / old[name]})
+    return comparison
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    import matplotlib
+    import sklearn
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'matplotlib': matplotlib.__version__,
+    }
+
+
+def run_scale(n_rows, benchmarks, repeat, seed, svm_rows):
+    """Benchmark one dataset size against the files in DIABETES_DATA_DIR."""
+    from dataset import CLEANED_CSV
+    from cleaning import RAW_CSV
+
+    result = {'rows': n_rows}
+    if not os.path.exists(RAW_CSV):
+        result['generate'], _ = timed(lambda: write_synthetic_csv(RAW_CSV, n_rows, seed))
+
+    if 'csv_load' in benchmarks:
+        result['csv_load'] = bench_csv_load(RAW_CSV, repeat)
+    if 'cleaning' in benchmarks or not os.path.exists(CLEANED_CSV):
+        cleaning = bench_cleaning(RAW_CSV, CLEANED_CSV, repeat)
+        if 'cleaning' in benchmarks:
+            result['cleaning'] = cleaning
+
+    cache, df = bench_cache(CLEANED_CSV, repeat)
+    if 'cache' in benchmarks:
+        result['cache'] = cache
+    if 'aggregation' in benchmarks:
+        result['aggregation'] = bench_aggregation(df, repeat)
+    if 'cohort' in benchmarks:
+        result['cohort'] = bench_cohort(df, repeat)
+    if 'render' in benchmarks:
+        result['render'] = bench_render(repeat)
+    if 'svm' in benchmarks:
+        result['svm'] = bench_svm(df, repeat, svm_rows, seed)
+    return result
+
+
+def run_isolated(n_rows, workdir, benchmarks, repeat, seed, svm_rows):
+    """Run one scale in a spawned process so every size starts from a cold, empty interpreter
+    and the project modules pick up that size's data directory."""
+    scale_dir = os.path.join(workdir, f'{n_rows}_{seed}')
+    os.makedirs(scale_dir, exist_ok=True)
+    os.environ['DIABETES_DATA_DIR'] = scale_dir
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_scale, n_rows, benchmarks, repeat, seed, svm_rows).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading, cleaning, aggregation, rendering and SVM '
+                                                 'training on synthetic diabetic_data.csv files.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000], help='dataset sizes, e.g. 100000 1000000 10000000')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement; the best is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--svm-rows', type=int, default=5000, help='training rows for the libsvm SVC measurement')
+    parser.add_argument('--workdir', help='keep generated CSVs here and reuse them on later runs')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report of an earlier run to compute time ratios against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        report = {
+            'environment': environment(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'results': [run_isolated(n_rows, workdir, args.only, args.repeat, args.seed, args.svm_rows)
+                        for n_rows in args.rows],
+        }
+
+    if args.compare:
+        with open(args.compare) as f:
+            report['comparison'] = compare_reports(json.load(f), report)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import CLEANED_CSV, DATA_DIR
+
+RAW_CSV = os.path.join(DATA_DIR, 'diabetic_data.csv')
+
+DIAG_COLUMNS = ['diag_1', 'diag_2', 'diag_3']
+
+CHUNK_SIZE = 100_000
+
+
+def read_chunks(path, chunksize=CHUNK_SIZE):
+    return pd.read_csv(path, chunksize=chunksize, dtype={column: str for column in DIAG_COLUMNS})
+
+
+def clean_diag_chunk(chunk, columns=DIAG_COLUMNS):
+    """Turn supplementary 'V' codes and '?' into NaN and the remaining codes into numbers."""
+    for column in columns:
+        values = chunk[column]
+        values = values.mask(values.str.contains('V', regex=False, na=False))
+        chunk[column] = pd.to_numeric(values, errors='coerce')
+    return chunk
+
+
+def median_from_counts(counts):
+    """Exact median of the values described by a value -> count Series (same result as Series.median)."""
+    counts = counts[counts > 0].sort_index()
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    cumulative = counts.cumsum().to_numpy()
+    values = counts.index.to_numpy()
+    lower = values[np.searchsorted(cumulative, (total + 1) // 2)]
+    upper = values[np.searchsorted(cumulative, total // 2 + 1)]
+    return (lower + upper) / 2
+
+
+def scan_diag_columns(path, chunksize=CHUNK_SIZE, columns=DIAG_COLUMNS):
+    """First pass: '?' and 'V' counts plus the value histogram of every diag column."""
+    question_marks = dict.fromkeys(columns, 0)
+    v_codes = dict.fromkeys(columns, 0)
+    histograms = {column: pd.Series(dtype='int64') for column in columns}
+    rows = 0
+    for chunk in read_chunks(path, chunksize):
+        rows += len(chunk)
+        for column in columns:
+            question_marks[column] += int(chunk[column].str.contains('?', regex=False, na=False).sum())
+            v_codes[column] += int(chunk[column].str.contains('V', regex=False, na=False).sum())
+        clean_diag_chunk(chunk, columns)
+        for column in columns:
+            histograms[column] = histograms[column].add(chunk[column].value_counts(), fill_value=0)
+    return rows, question_marks, v_codes, histograms
+
+
+def write_cleaned(path, output_path, medians, chunksize=CHUNK_SIZE):
+    """Second pass: clean and impute every chunk, appending it to the output as it goes."""
+    tmp_path = output_path + '.tmp'
+    rows = 0
+    with open(tmp_path, 'w', newline='') as f:
+        for chunk in read_chunks(path, chunksize):
+            clean_diag_chunk(chunk)
+            chunk = chunk.fillna(medians)
+            chunk.to_csv(f, index=False, header=rows == 0)
+            rows += len(chunk)
+    os.replace(tmp_path, output_path)
+    return rows
+
+
+def run_pipeline(raw_path=RAW_CSV, output_path=CLEANED_CSV, chunksize=CHUNK_SIZE):
+    """Clean the raw extract into the median-imputed CSV that load_dataset() reads.
+
+    The raw file is streamed twice in chunks, so memory stays bounded by the
+    chunk size and the number of distinct diag codes regardless of file size.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    rows, question_marks, v_codes, histograms = scan_diag_columns(raw_path, chunksize)
+    timings['scan'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    medians = {column: median_from_counts(histogram) for column, histogram in histograms.items()}
+    timings['medians'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_cleaned(raw_path, output_path, medians, chunksize)
+    timings['write'] = time.perf_counter() - start
+
+    total = sum(timings.values())
+    return {
+        'rows': rows,
+        'question_marks': question_marks,
+        'v_codes': v_codes,
+        'medians': medians,
+        'timings': timings,
+        'rows_per_sec': {stage: rows / seconds if seconds else float('inf') for stage, seconds in timings.items()},
+        'total_seconds': total,
+    }
+
+
+def print_report(report):
+    print(f"Cleaned {report['rows']} rows in {report['total_seconds']:.2f}s "
+          f"({report['rows'] / report['total_seconds']:,.0f} rows/sec)")
+    for column in DIAG_COLUMNS:
+        print(f"  {column}: {report['question_marks'][column]} '?', {report['v_codes'][column]} 'V' codes, "
+              f"median {report['medians'][column]}")
+    for stage, seconds in report['timings'].items():
+        print(f"  {stage:<8} {seconds:8.3f}s  {report['rows_per_sec'][stage]:>14,.0f} rows/sec")
+
+
+if __name__ == '__main__':
+    raw_path = sys.argv[1] if len(sys.argv) > 1 else RAW_CSV
+    output_path = sys.argv[2] if len(sys.argv) > 2 else CLEANED_CSV
+    print_report(run_pipeline(raw_path, output_path))
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from drug_cube import cube_from_codes, readmitted_codes
+from medication_codes import MEDICATIONS, VersionedCache, medication_codes
+
+COHORT_COLUMNS = ['age', 'gender', 'admission_type_id', 'A1Cresult', 'max_glu_serum', 'time_in_hospital']
+# Filtered by an inclusive [low, high] range instead of a list of values.
+RANGE_COLUMNS = ['time_in_hospital']
+# What the raw extract writes for a test that was not taken (A1Cresult, max_glu_serum); read as missing.
+MISSING_LABEL = 'None'
+
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+_cache = VersionedCache()
+
+
+def _sort_key(value):
+    return isinstance(value, str), value
+
+
+def cohort_key(filters):
+    """Hashable form of a filter dict, for cache and job keys."""
+    return tuple(sorted((column, tuple(values)) for column, values in (filters or {}).items() if values))
+
+
+class CohortIndex:
+    """A packed bitmap of the rows holding each value of the cohort columns.
+
+    A filter ``{column: [values]}`` (``[low, high]`` for RANGE_COLUMNS) is the
+    OR of its values' bitmaps, and filters on several columns are ANDed, so a
+    compound filter costs a few passes over n_rows / 8 bytes instead of string
+    comparisons over the frame. The selected rows then feed the same counting
+    as build_cube.
+    """
+
+    def __init__(self, bitmaps, n_rows, medication_matrix, readmitted):
+        self.bitmaps = bitmaps
+        self.n_rows = n_rows
+        self.medication_matrix = medication_matrix
+        self.readmitted = readmitted
+
+    @classmethod
+    def from_frame(cls, df, columns=COHORT_COLUMNS):
+        bitmaps = {}
+        for column in columns:
+            if column not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[column])
+            bitmaps[column] = {value.item() if isinstance(value, np.generic) else value: np.packbits(codes == i)
+                               for i, value in enumerate(uniques)}
+            if (codes < 0).any():
+                missing = np.packbits(codes < 0)
+                bitmaps[column][MISSING_LABEL] = bitmaps[column].get(MISSING_LABEL, 0) | missing
+        return cls(bitmaps, len(df), medication_codes(df), readmitted_codes(df))
+
+    @property
+    def columns(self):
+        return list(self.bitmaps)
+
+    @property
+    def nbytes(self):
+        return sum(bitmap.nbytes for bitmaps in self.bitmaps.values() for bitmap in bitmaps.values())
+
+    def values(self, column):
+        return sorted(self.bitmaps[column], key=_sort_key)
+
+    def value_counts(self, column):
+        return {value: int(_POPCOUNT[self.bitmaps[column][value]].sum()) for value in self.values(column)}
+
+    def select(self, filters):
+        """Bitmap of the rows matching ``filters``, or None when nothing is filtered (all rows)."""
+        selection = None
+        for column, wanted in (filters or {}).items():
+            if not wanted:
+                continue
+            bitmaps = self.bitmaps[column]
+            if column in RANGE_COLUMNS:
+                low, high = wanted
+                wanted = [value for value in bitmaps if not isinstance(value, str) and low <= value <= high]
+            matched = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+            for value in wanted:
+                if value in bitmaps:
+                    matched |= bitmaps[value]
+            if selection is None:
+                selection = matched
+            else:
+                selection &= matched
+        return selection
+
+    def count(self, filters):
+        selection = self.select(filters)
+        return self.n_rows if selection is None else int(_POPCOUNT[selection].sum())
+
+    def rows(self, filters):
+        """Positions of the matching rows, in order."""
+        selection = self.select(filters)
+        if selection is None:
+            return np.arange(self.n_rows)
+        return np.flatnonzero(np.unpackbits(selection, count=self.n_rows))
+
+    def cube(self, filters, medications=MEDICATIONS):
+        """DrugCube of ``medications`` over the matching rows; pass only the drugs needed to keep it fast."""
+        rows = self.rows(filters)
+        codes = {drug: self.medication_matrix.column(drug)[rows] for drug in medications}
+        return cube_from_codes(codes, self.readmitted[rows], medications)
+
+
+def cohort_index(df):
+    """CohortIndex of ``df``, cached per frame and dataset version like medication_codes."""
+    return _cache.get(df, lambda: CohortIndex.from_frame(df))
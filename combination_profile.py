@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from drug_cube import READMITTED_STATUSES, UNMAPPED_STATUS, readmitted_codes
+from medication_codes import BITS_PER_DRUG, MEDICATIONS, USAGE_LEVELS, medication_codes
+
+
+def pack_combinations(df, medications=MEDICATIONS):
+    """Encode every patient's medication state as one integer, 2 bits per drug.
+
+    Missing or unknown values count as 'No', like fillna('No') in the notebooks.
+    """
+    return medication_codes(df).combinations(medications)
+
+
+def unpack_combination(code, medications=MEDICATIONS):
+    return {drug: USAGE_LEVELS[(int(code) >> (BITS_PER_DRUG * i)) & 0b11] for i, drug in enumerate(medications)}
+
+
+def describe_combination(code, medications=MEDICATIONS):
+    levels = unpack_combination(code, medications)
+    active = [f'{drug.capitalize()} ({level})' for drug, level in levels.items() if level != 'No']
+    return ' & '.join(active) if active else 'No medication'
+
+
+class CombinationProfile:
+    """Readmitted status counts for every distinct full medication combination."""
+
+    def __init__(self, codes, status_counts, medications=MEDICATIONS):
+        self.codes = codes
+        self.status_counts = status_counts
+        self.medications = medications
+
+    def __len__(self):
+        return len(self.codes)
+
+    def merge(self, other):
+        """Profile over the patients of both profiles; combinations seen in only one count zero in the other."""
+        codes = np.union1d(self.codes, other.codes)
+        status_counts = np.zeros((len(codes), self.status_counts.shape[1]), dtype=np.int64)
+        for profile in (self, other):
+            status_counts[np.searchsorted(codes, profile.codes)] += profile.status_counts
+        return CombinationProfile(codes, status_counts, self.medications)
+
+    def combination_counts(self, codes):
+        """Readmitted status counts (unmapped statuses left out) of the given combination codes."""
+        counts = self.status_counts[np.searchsorted(self.codes, codes), :UNMAPPED_STATUS]
+        return pd.DataFrame(counts, index=pd.Index(codes, name='Code'), columns=READMITTED_STATUSES)
+
+    def table(self):
+        mapped = self.status_counts[:, :UNMAPPED_STATUS]
+        totals = mapped.sum(axis=1, keepdims=True)
+        rates = np.divide(mapped * 100.0, totals, out=np.zeros(mapped.shape), where=totals > 0)
+        table = pd.DataFrame(rates, columns=READMITTED_STATUSES)
+        table.insert(0, 'Support', self.status_counts.sum(axis=1))
+        table.insert(0, 'Code', self.codes)
+        table['Readmitted'] = table['Up'] + table['Down']
+        return table
+
+    def top(self, n=10, sort_by='Support', min_support=1, include_no_medication=True):
+        """Top-N combinations with their support and readmission rates (percent)."""
+        table = self.table()
+        table = table[table['Support'] >= min_support]
+        if not include_no_medication:
+            table = table[table['Code'] != 0]
+        table = table.sort_values([sort_by, 'Support'], ascending=False).head(n)
+        table.insert(0, 'Combination', [describe_combination(code, self.medications) for code in table['Code']])
+        return table.reset_index(drop=True)
+
+
+def build_profile(df, medications=MEDICATIONS):
+    packed = pack_combinations(df, medications)
+    readmitted = readmitted_codes(df).astype(np.int64)
+
+    codes, inverse = np.unique(packed, return_inverse=True)
+    n_statuses = UNMAPPED_STATUS + 1
+    status_counts = np.bincount(inverse.ravel() * n_statuses + readmitted,
+                                minlength=len(codes) * n_statuses).reshape(len(codes), n_statuses)
+    return CombinationProfile(codes, status_counts, medications)
@@ -0,0 +1,147 @@
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from drug_cube import READMITTED_STATUSES
+
+N_BOOT = 2000
+CONFIDENCE = 0.95
+# Below this expected count the chi-square approximation is unreliable and Fisher's exact test is used instead.
+MIN_EXPECTED = 5
+
+# Statuses that count as a readmission ('>30' and '<30' days).
+READMITTED = ['Up', 'Down']
+RATE_COLUMNS = READMITTED_STATUSES + ['Readmitted']
+
+
+def _with_readmitted(values):
+    readmitted = values[..., [READMITTED_STATUSES.index(status) for status in READMITTED]].sum(axis=-1)
+    return np.concatenate([values, readmitted[..., None]], axis=-1)
+
+
+def bootstrap_rates(counts, n_boot=N_BOOT, confidence=CONFIDENCE, seed=0):
+    """Percentile bootstrap intervals (percent) of the status rates of every row of a count table.
+
+    A replicate redraws a row's patients from its observed status proportions
+    with one multinomial draw, which is what resampling the patients would do
+    at a cost independent of their number. Returns ``low`` and ``high`` arrays
+    with one column per RATE_COLUMNS entry; rows without patients are NaN.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    totals = counts.sum(axis=1)
+    proportions = np.divide(counts, totals[:, None], out=np.full(counts.shape, 1 / counts.shape[1]),
+                            where=totals[:, None] > 0)
+    draws = np.random.default_rng(seed).multinomial(totals, proportions, size=(n_boot, len(counts)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = _with_readmitted(draws) * 100.0 / totals[:, None]
+    alpha = 1 - confidence
+    low, high = np.quantile(rates, [alpha / 2, 1 - alpha / 2], axis=0)
+    return low, high
+
+
+def combination_tests(counts, min_expected=MIN_EXPECTED):
+    """Does each row's status distribution differ from that of all other rows together?
+
+    Row against rest is a 2 x statuses chi-square test, computed for all rows at
+    once. Where an expected count falls below ``min_expected`` the p-value comes
+    from Fisher's exact test of readmitted vs not readmitted instead. Returns the
+    statistics (chi-square, or Fisher's odds ratio), p-values and the name of the
+    test used per row.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    tables = np.stack([counts, counts.sum(axis=0) - counts], axis=1).astype(np.float64)
+    n = tables.sum(axis=(1, 2))
+    expected = tables.sum(axis=2, keepdims=True) * tables.sum(axis=1, keepdims=True) / n[:, None, None]
+    used = expected.sum(axis=1) > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = np.where(used[:, None, :], (tables - expected) ** 2 / expected, 0).sum(axis=(1, 2))
+    dof = used.sum(axis=1) - 1
+    degenerate = (dof < 1) | (tables.sum(axis=2) == 0).any(axis=1)
+    p_value = np.where(degenerate, 1.0, stats.chi2.sf(statistic, np.maximum(dof, 1)))
+    statistic = np.where(degenerate, 0.0, statistic)
+    test = np.where(degenerate, 'none', 'chi2').astype(object)
+
+    small = ~degenerate & (np.where(used[:, None, :], expected, np.inf).min(axis=(1, 2)) < min_expected)
+    readmitted = _with_readmitted(tables)[..., -1]
+    for i in np.flatnonzero(small):
+        table = np.column_stack([readmitted[i], tables[i].sum(axis=1) - readmitted[i]]).astype(np.int64)
+        statistic[i], p_value[i] = stats.fisher_exact(table)
+        test[i] = 'fisher'
+    return statistic, p_value, test
+
+
+def combination_statistics(counts, n_boot=N_BOOT, confidence=CONFIDENCE, seed=0):
+    """Support, status rates (percent) with bootstrap intervals and a significance test per combination.
+
+    ``counts`` holds readmitted status counts indexed by combination, like
+    DrugCube.combination_counts. The rate columns match combination_percentages;
+    ``<status> low`` and ``<status> high`` bound them, and ``p_value`` tests the
+    combination against the other combinations of the same pair.
+    """
+    values = counts[READMITTED_STATUSES].to_numpy(np.int64)
+    totals = values.sum(axis=1)
+    rates = np.divide(_with_readmitted(values) * 100.0, totals[:, None], out=np.zeros((len(values), len(RATE_COLUMNS))),
+                      where=totals[:, None] > 0)
+    low, high = bootstrap_rates(values, n_boot, confidence, seed)
+    statistic, p_value, test = combination_tests(values)
+
+    result = pd.DataFrame(rates, index=counts.index, columns=RATE_COLUMNS)
+    result.insert(0, 'Support', totals)
+    for i, status in enumerate(RATE_COLUMNS):
+        result[f'{status} low'] = low[:, i]
+        result[f'{status} high'] = high[:, i]
+    result['statistic'] = statistic
+    result['p_value'] = p_value
+    result['test'] = test
+    return result
+
+
+def pair_statistics(cube, drug1, drug2, n_boot=N_BOOT, confidence=CONFIDENCE, seed=0):
+    return combination_statistics(cube.combination_counts(drug1, drug2), n_boot, confidence, seed)
+
+
+def all_pair_statistics(cube, pairs=None, n_boot=N_BOOT, confidence=CONFIDENCE, seed=0, n_jobs=None):
+    """pair_statistics of many drug pairs, spread over a process pool.
+
+    Every pair gets its own seed derived from ``seed``, so the intervals do not
+    depend on ``n_jobs``.
+    """
+    pairs = list(pairs or itertools.combinations(cube.level_totals, 2))
+    tables = [cube.combination_counts(drug1, drug2) for drug1, drug2 in pairs]
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs))
+    args = (tables, [n_boot] * len(pairs), [confidence] * len(pairs), seeds)
+    if n_jobs == 1:
+        results = list(map(combination_statistics, *args))
+    else:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            results = list(executor.map(combination_statistics, *args))
+    return dict(zip(pairs, results))
+
+
+if __name__ == '__main__':
+    from dataset import load_dataset
+    from drug_cube import build_cube
+
+    parser = argparse.ArgumentParser(description='Bootstrap intervals and tests for every drug-pair combination.')
+    parser.add_argument('--boot', type=int, default=N_BOOT, help='bootstrap replicates')
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int)
+    parser.add_argument('--output', default='combination_stats.csv')
+    args = parser.parse_args()
+
+    cube = build_cube(load_dataset())
+    start = time.perf_counter()
+    results = all_pair_statistics(cube, n_boot=args.boot, confidence=args.confidence, seed=args.seed,
+                                  n_jobs=args.jobs)
+    seconds = time.perf_counter() - start
+    table = pd.concat({f'{drug1} & {drug2}': result for (drug1, drug2), result in results.items()},
+                      names=['Pair', 'Combination'])
+    table.to_csv(args.output)
+    print(f'{len(table)} combinations of {len(results)} pairs with {args.boot} replicates in {seconds:.2f}s '
+          f'-> {args.output}')
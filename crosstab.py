@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cleaning import CHUNK_SIZE
+from dataset import DATA_DIR
+from medication_codes import ALL_MEDICATIONS
+
+STORE_DIR = os.environ.get('DIABETES_CROSSTAB_DIR', os.path.join(DATA_DIR, 'crosstab'))
+META_FILE = 'store.json'
+
+# Columns worth cross-tabulating; identifiers would only blow up the level dictionaries.
+DEFAULT_COLUMNS = ALL_MEDICATIONS + ['readmitted', 'age', 'gender', 'race', 'admission_type_id',
+                                     'discharge_disposition_id', 'admission_source_id', 'time_in_hospital',
+                                     'A1Cresult', 'max_glu_serum', 'change', 'diabetesMed']
+
+# Above this many cells the counts are reduced as sparse (key, count) pairs instead of dense arrays.
+DENSE_LIMIT = 1 << 24
+
+
+def _python_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _code_dtype(n_levels):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_levels < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class CrosstabStore:
+    """Columns of one or more CSV extracts as integer codes, one .npy file per column and chunk.
+
+    Each column has a level dictionary shared by all chunks (codes in order of
+    first appearance, -1 for missing). Chunk files are opened memory-mapped,
+    so a query touches only the columns it needs and memory stays bounded by
+    what the operating system keeps cached.
+    """
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {'columns': None, 'levels': {}, 'float_columns': [], 'chunks': [], 'sources': []}
+
+    @property
+    def columns(self):
+        return self.meta['columns'] or []
+
+    @property
+    def rows(self):
+        return sum(chunk['rows'] for chunk in self.meta['chunks'])
+
+    def _save(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def add_csv(self, csv_path, columns=None, chunksize=CHUNK_SIZE):
+        """Append a CSV extract in chunks; returns the number of rows added."""
+        os.makedirs(self.path, exist_ok=True)
+        header = pd.read_csv(csv_path, nrows=0).columns
+        if self.meta['columns'] is None:
+            self.meta['columns'] = [column for column in (columns or DEFAULT_COLUMNS) if column in header]
+        missing = [column for column in self.columns if column not in header]
+        if missing:
+            raise ValueError(f'{csv_path} lacks the store columns {missing}')
+
+        index = {column: {value: code for code, value in enumerate(self.meta['levels'].get(column, []))}
+                 for column in self.columns}
+        float_columns = set(self.meta['float_columns'])
+        rows = 0
+        for chunk in pd.read_csv(csv_path, usecols=self.columns, chunksize=chunksize):
+            name = f'chunk-{len(self.meta["chunks"]):06d}'
+            os.makedirs(os.path.join(self.path, name), exist_ok=True)
+            for column in self.columns:
+                codes, uniques = pd.factorize(chunk[column])
+                if chunk[column].dtype.kind == 'f':
+                    float_columns.add(column)
+                levels = index[column]
+                mapping = np.array([levels.setdefault(_python_value(value), len(levels)) for value in uniques] + [-1],
+                                   dtype=np.int64)
+                np.save(os.path.join(self.path, name, f'{column}.npy'),
+                        mapping[codes].astype(_code_dtype(len(levels))))
+            self.meta['chunks'].append({'dir': name, 'rows': len(chunk)})
+            rows += len(chunk)
+
+        self.meta['levels'] = {column: list(levels) for column, levels in index.items()}
+        self.meta['float_columns'] = sorted(float_columns)
+        self.meta['sources'].append({'path': os.path.abspath(csv_path), 'rows': rows, 'added': time.time()})
+        self._save()
+        return rows
+
+    def sorted_levels(self, column):
+        """The column's levels in the order pd.crosstab shows them, and the old code -> sorted position table."""
+        levels = self.meta['levels'][column]
+        if column in self.meta['float_columns']:
+            levels = [float(level) for level in levels]
+        order = sorted(range(len(levels)), key=levels.__getitem__)
+        position = np.empty(len(levels) + 1, dtype=np.int64)
+        position[order] = np.arange(len(levels))
+        position[-1] = -1
+        return [levels[i] for i in order], position
+
+    def chunk_files(self, chunk, columns):
+        return [os.path.join(self.path, chunk['dir'], f'{column}.npy') for column in columns]
+
+
+def _count_chunks(files, positions, shape, dense):
+    """Counts of the code combinations in a group of chunks: a dense array, or sorted (keys, counts)."""
+    size = int(np.prod(shape, dtype=np.int64))
+    total = np.zeros(size, dtype=np.int64) if dense else None
+    keys, counts = [], []
+    for chunk_files in files:
+        key = None
+        valid = None
+        for path, position, n_levels in zip(chunk_files, positions, shape):
+            codes = position[np.load(path, mmap_mode='r')]
+            valid = codes >= 0 if valid is None else valid & (codes >= 0)
+            key = codes if key is None else key * n_levels + codes
+        key = key[valid]
+        if dense:
+            total += np.bincount(key, minlength=size)
+        else:
+            unique, unique_counts = np.unique(key, return_counts=True)
+            keys.append(unique)
+            counts.append(unique_counts)
+    if dense:
+        return total
+    return _merge_sparse(keys, counts)
+
+
+def _merge_sparse(keys, counts):
+    if not keys:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    unique, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    return unique, np.bincount(inverse.ravel(), weights=np.concatenate(counts), minlength=len(unique)).astype(np.int64)
+
+
+def crosstab(index, columns, store=STORE_DIR, n_jobs=None, normalize=False):
+    """``pd.crosstab`` of store columns, computed in one pass over the chunks by a process pool.
+
+    ``index`` and ``columns`` are column names or lists of them (e.g.
+    ``crosstab(['metformin', 'glipizide'], ['readmitted', 'gender'])``). Rows
+    where any of them is missing are left out, as pd.crosstab does. The
+    chunks are split into groups that workers count independently; the
+    partial counts are summed at the end.
+    """
+    store = store if isinstance(store, CrosstabStore) else CrosstabStore(store)
+    index = [index] if isinstance(index, str) else list(index)
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    variables = index + columns
+    unknown = [column for column in variables if column not in store.columns]
+    if unknown:
+        raise KeyError(f'Columns {unknown} are not in the store {store.path}')
+
+    levels, positions = zip(*(store.sorted_levels(column) for column in variables))
+    shape = tuple(len(column_levels) for column_levels in levels)
+    dense = int(np.prod(shape, dtype=np.int64)) <= DENSE_LIMIT
+    files = [store.chunk_files(chunk, variables) for chunk in store.meta['chunks']]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    groups = [files[i::n_jobs * 4] for i in range(min(len(files), n_jobs * 4))]
+    if n_jobs == 1 or len(groups) <= 1:
+        partials = [_count_chunks(group, positions, shape, dense) for group in groups]
+    else:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            partials = list(executor.map(_count_chunks, groups, *zip(*[(positions, shape, dense)] * len(groups))))
+
+    if dense:
+        total = np.sum(partials, axis=0) if partials else np.zeros(int(np.prod(shape)), dtype=np.int64)
+        keys = np.flatnonzero(total)
+        counts = total[keys]
+    else:
+        keys, counts = _merge_sparse(*zip(*partials)) if partials else _merge_sparse([], [])
+
+    codes = np.unravel_index(keys, shape) if shape else ()
+    cells = pd.Series(counts, index=pd.MultiIndex(levels=[pd.Index(column_levels) for column_levels in levels],
+                                                  codes=list(codes), names=variables))
+    table = cells.unstack(list(range(len(index), len(variables))), fill_value=0)
+    table = table.sort_index().sort_index(axis=1)
+    table.columns.names = columns
+    table.index.names = index
+    if normalize in (True, 'all'):
+        table = table / table.to_numpy().sum()
+    elif normalize == 'index':
+        table = table.div(table.sum(axis=1), axis=0)
+    elif normalize == 'columns':
+        table = table / table.sum(axis=0)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Out-of-core crosstabs over pooled encounter extracts.')
+    parser.add_argument('--store', default=STORE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add = subparsers.add_parser('add', help='append CSV extracts to the store')
+    add.add_argument('csv', nargs='+')
+    add.add_argument('--columns', nargs='+', help=f'columns to store (default: those of {DEFAULT_COLUMNS} present)')
+    add.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    query = subparsers.add_parser('query', help='crosstab store columns')
+    query.add_argument('--index', nargs='+', required=True)
+    query.add_argument('--columns', nargs='+', required=True)
+    query.add_argument('--normalize', choices=['all', 'index', 'columns'])
+    query.add_argument('--jobs', type=int)
+    query.add_argument('--output', help='write the table to this CSV instead of printing it')
+    args = parser.parse_args()
+
+    store = CrosstabStore(args.store)
+    if args.command == 'add':
+        for path in args.csv:
+            start = time.perf_counter()
+            rows = store.add_csv(path, args.columns, args.chunksize)
+            print(f'{path}: {rows} rows in {time.perf_counter() - start:.1f}s, store has {store.rows} rows')
+    else:
+        start = time.perf_counter()
+        table = crosstab(args.index, args.columns, store, args.jobs, args.normalize or False)
+        seconds = time.perf_counter() - start
+        if args.output:
+            table.to_csv(args.output)
+        else:
+            print(table)
+        print(f'{store.rows} rows in {seconds:.2f}s ({store.rows / seconds:,.0f} rows/s)')
@@ -0,0 +1,145 @@
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+DATA_DIR = os.environ.get('DIABETES_DATA_DIR', 'D:/diabetes+130-us+hospitals+for+years+1999-2008')
+CLEANED_CSV = os.path.join(DATA_DIR, 'cleaned_diabetic_data_with_Median.csv')
+
+CACHE_VERSION = 1
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = 'feather'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_paths(csv_path):
+    base, _ = os.path.splitext(csv_path)
+    return base + '.' + CACHE_FORMAT, base + '.meta.json'
+
+
+def optimize_dtypes(df):
+    """Store string columns as categoricals and integer columns in the narrowest int type."""
+    for column in df.columns:
+        if df[column].dtype == object or pd.api.types.is_string_dtype(df[column].dtype):
+            df[column] = df[column].astype('category')
+        elif pd.api.types.is_integer_dtype(df[column].dtype):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+    return df
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def _cache_is_valid(csv_path, cache_path, meta_path, stat):
+    meta = _read_meta(meta_path)
+    if meta is None or not os.path.exists(cache_path):
+        return None
+    if meta.get('cache_version') != CACHE_VERSION or meta.get('format') != CACHE_FORMAT:
+        return None
+    if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return meta
+    # The file was touched or copied: only trust the cache if the content is unchanged.
+    if meta['size'] == stat.st_size and meta['sha256'] == file_sha256(csv_path):
+        meta['mtime_ns'] = stat.st_mtime_ns
+        _write_meta(meta_path, meta)
+        return meta
+    return None
+
+
+def build_cache(csv_path=CLEANED_CSV):
+    cache_path, meta_path = cache_paths(csv_path)
+    # Hash and parse the same bytes, so a CSV rewritten meanwhile cannot be recorded
+    # with another content's hash. The stat is taken first: if the file changes
+    # after it, the next load sees a new mtime and checks the hash.
+    with open(csv_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        content = f.read()
+    df = optimize_dtypes(pd.read_csv(io.BytesIO(content)))
+
+    tmp_path = cache_path + '.tmp'
+    if CACHE_FORMAT == 'feather':
+        df.to_feather(tmp_path)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+
+    meta = {
+        'cache_version': CACHE_VERSION,
+        'format': CACHE_FORMAT,
+        'source': os.path.abspath(csv_path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': hashlib.sha256(content).hexdigest(),
+        'rows': len(df),
+    }
+    _write_meta(meta_path, meta)
+    return df, meta
+
+
+def dataset_version(csv_path=CLEANED_CSV):
+    """The version load_dataset reports for the file, without loading it."""
+    cache_path, meta_path = cache_paths(csv_path)
+    meta = _cache_is_valid(csv_path, cache_path, meta_path, os.stat(csv_path))
+    return (meta['sha256'] if meta is not None else file_sha256(csv_path))[:12]
+
+
+def load_dataset(csv_path=CLEANED_CSV, categorical=True):
+    """Load the cleaned dataset from the typed binary cache, rebuilding it when the CSV changed.
+
+    The dataset version (a prefix of the source file's SHA-256) is available as
+    ``df.attrs['version']``. Pass ``categorical=False`` to get the plain object
+    columns that ``pd.read_csv`` would have produced.
+    """
+    cache_path, meta_path = cache_paths(csv_path)
+    meta = _cache_is_valid(csv_path, cache_path, meta_path, os.stat(csv_path))
+    if meta is None:
+        df, meta = build_cache(csv_path)
+    elif CACHE_FORMAT == 'feather':
+        df = pd.read_feather(cache_path)
+    else:
+        df = pd.read_pickle(cache_path)
+
+    if not categorical:
+        for column in df.select_dtypes('category').columns:
+            df[column] = df[column].astype(object)
+    df.attrs['version'] = meta['sha256'][:12]
+    return df
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else CLEANED_CSV
+    start = time.perf_counter()
+    df, meta = build_cache(path)
+    print(f"Built {cache_paths(path)[0]} ({meta['rows']} rows) in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    load_dataset(path)
+    print(f"Cached load: {time.perf_counter() - start:.3f}s")
+    print(f"In-memory size: {df.memory_usage(deep=True).sum() / 1e6:.1f} MB")
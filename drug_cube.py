@@ -0,0 +1,130 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from medication_codes import (ALL_MEDICATIONS, LABEL_ORDER, MEDICATIONS, USAGE_LEVELS, encode_column,  # noqa: F401
+                              medication_codes)
+
+READMITTED_MAPPING = {
+    '>30': 'Up',
+    '<30': 'Down',
+    'NO': 'No'
+}
+READMITTED_STATUSES = ['Up', 'Down', 'No']
+
+# Rows whose readmitted value is not in READMITTED_MAPPING land in this extra
+# bucket: they still count towards drug usage, but not towards percentages.
+UNMAPPED_STATUS = len(READMITTED_STATUSES)
+
+
+def quantile_from_counts(counts, q):
+    """Linearly interpolated q-quantile of a sample given as counts of the values 0..len(counts)-1."""
+    position = (counts.sum() - 1) * q
+    cumulative = np.cumsum(counts)
+    lower = np.searchsorted(cumulative, np.floor(position), side='right')
+    upper = np.searchsorted(cumulative, np.ceil(position), side='right')
+    return lower + (upper - lower) * (position - np.floor(position))
+
+
+class DrugCube:
+    """Drug1 level x drug2 level x readmitted status counts for every medication pair."""
+
+    def __init__(self, pairs, level_totals):
+        self.pairs = pairs
+        self.level_totals = level_totals
+
+    def merge(self, other):
+        """Cube over the rows of both cubes, e.g. the current data plus a newly ingested batch."""
+        pairs = {key: counts + other.pair_counts(*key) for key, counts in self.pairs.items()}
+        level_totals = {drug: totals + other.level_totals[drug] for drug, totals in self.level_totals.items()}
+        return DrugCube(pairs, level_totals)
+
+    def pair_counts(self, drug1, drug2):
+        if (drug1, drug2) in self.pairs:
+            return self.pairs[(drug1, drug2)]
+        return self.pairs[(drug2, drug1)].transpose(1, 0, 2)
+
+    def combination_counts(self, drug1, drug2):
+        """Readmitted status counts per observed '<drug1> & <drug2>' combination (unmapped statuses left out)."""
+        counts = self.pair_counts(drug1, drug2)
+        index, rows = [], []
+        for i, level1 in enumerate(USAGE_LEVELS):
+            for j, level2 in enumerate(USAGE_LEVELS):
+                if counts[i, j].sum() == 0:
+                    continue
+                index.append(f'{level1} & {level2}')
+                rows.append(counts[i, j, :UNMAPPED_STATUS])
+        return pd.DataFrame(np.array(rows, dtype=np.int64).reshape(len(rows), UNMAPPED_STATUS),
+                            index=pd.Index(index, name='Combination'), columns=READMITTED_STATUSES)
+
+    def combination_percentages(self, drug1, drug2):
+        """Percentage of each readmitted status per observed '<drug1> & <drug2>' combination."""
+        counts = self.combination_counts(drug1, drug2)
+        totals = counts.sum(axis=1).to_numpy()[:, None]
+        percentages = np.divide(counts.to_numpy() * 100.0, totals, out=np.zeros(counts.shape), where=totals > 0)
+        return pd.DataFrame(percentages, index=counts.index, columns=READMITTED_STATUSES)
+
+    def level_counts(self, drug1, drug2):
+        """Usage level counts of drug1 over the rows where both drugs are recorded."""
+        counts = self.pair_counts(drug1, drug2).sum(axis=(1, 2))
+        return dict(zip(USAGE_LEVELS, counts))
+
+    def distribution_summary(self, drug1, drug2, order=LABEL_ORDER):
+        """Box-plot statistics of drug2's level position (in ``order``) for every drug1 level."""
+        counts = self.pair_counts(drug1, drug2).sum(axis=2)[:, [USAGE_LEVELS.index(level) for level in order]]
+        values = np.arange(len(order))
+        rows = []
+        for level1, level_counts in zip(USAGE_LEVELS, counts):
+            total = level_counts.sum()
+            if total == 0:
+                continue
+            q1, median, q3 = (quantile_from_counts(level_counts, q) for q in (0.25, 0.5, 0.75))
+            iqr = q3 - q1
+            present = values[level_counts > 0]
+            rows.append({
+                'level': level1,
+                'count': total,
+                'q1': q1,
+                'median': median,
+                'q3': q3,
+                'lowerfence': present[present >= q1 - 1.5 * iqr].min(),
+                'upperfence': present[present <= q3 + 1.5 * iqr].max(),
+                'mean': (values * level_counts).sum() / total,
+            })
+        return pd.DataFrame(rows)
+
+    def mode(self, drug):
+        totals = self.level_totals[drug]
+        if totals.sum() == 0:
+            return None
+        # Same tie-break as Series.mode()[0]: the smallest value among the most frequent.
+        return min(level for level, count in zip(USAGE_LEVELS, totals) if count == totals.max())
+
+
+def readmitted_codes(df):
+    """Per row index into READMITTED_STATUSES, UNMAPPED_STATUS for other values."""
+    readmitted = encode_column(df['readmitted'].map(READMITTED_MAPPING), READMITTED_STATUSES)
+    return np.where(readmitted < 0, UNMAPPED_STATUS, readmitted).astype(np.int8)
+
+
+def cube_from_codes(codes, readmitted, medications=MEDICATIONS):
+    """DrugCube of ``medications`` given their usage level codes (drug -> array) and readmitted_codes."""
+    readmitted = readmitted.astype(np.int64)
+    n_levels = len(USAGE_LEVELS)
+    n_statuses = UNMAPPED_STATUS + 1
+    pairs = {}
+    for drug1, drug2 in itertools.combinations(medications, 2):
+        valid = (codes[drug1] >= 0) & (codes[drug2] >= 0)
+        key = (codes[drug1][valid].astype(np.int64) * n_levels + codes[drug2][valid]) * n_statuses + readmitted[valid]
+        pairs[(drug1, drug2)] = np.bincount(key, minlength=n_levels * n_levels * n_statuses).reshape(
+            n_levels, n_levels, n_statuses)
+
+    level_totals = {drug: np.bincount(codes[drug][codes[drug] >= 0], minlength=n_levels) for drug in medications}
+    return DrugCube(pairs, level_totals)
+
+
+def build_cube(df, medications=MEDICATIONS):
+    medication_matrix = medication_codes(df)
+    codes = {drug: medication_matrix.column(drug) for drug in medications}
+    return cube_from_codes(codes, readmitted_codes(df), medications)
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class FigureCache:
+    """Size-bounded LRU cache of rendered figure payloads (e.g. base64 PNG data URIs).
+
+    Keys are tuples such as ('distribution', drug, dataset_version). When
+    ``cache_dir`` is set, payloads are also written to disk so that a restarted
+    process can serve them without re-rendering. The directory is kept under
+    ``max_disk_bytes`` by deleting the least recently used files; processes
+    sharing it each count only their own writes between scans, so it can
+    briefly exceed the budget.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, cache_dir=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_size = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._trim_disk()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + '.txt')
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        payload = self._read_disk(key) if self.cache_dir else None
+        if payload is not None:
+            self._store(key, payload)
+            with self._lock:
+                self.hits += 1
+            return payload
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, payload):
+        self._store(key, payload)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_size += len(payload)
+                trim = self._disk_size > self.max_disk_bytes
+            if trim:
+                self._trim_disk()
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                payload = f.read()
+            # The modification time orders eviction, so a read marks the file as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            # Not written yet, or evicted by another process.
+            return None
+        return payload
+
+    def _trim_disk(self):
+        """Delete the least recently used files until the directory fits in ``max_disk_bytes``."""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.txt'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._disk_size = total
+
+    def _store(self, key, payload):
+        size = len(payload)
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            if size > self.max_bytes:
+                return
+            self._entries[key] = payload
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_render(self, key, render):
+        payload = self.get(key)
+        if payload is None:
+            payload = render()
+            self.put(key, payload)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
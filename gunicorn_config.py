@@ -0,0 +1,20 @@
+import multiprocessing
+import os
+import sys
+
+# gunicorn -c gunicorn_config.py OLAP:server
+bind = os.environ.get('DASH_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('DASH_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('DASH_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('DASH_TIMEOUT', '120'))
+
+# Import the app, and with it the dataset and the aggregate cubes, once in the
+# master process. Forked workers then share those pages copy-on-write instead
+# of each loading its own copy.
+preload_app = True
+
+# A background data load in the master would not survive the fork, so load it
+# before forking. (serve.py only reads the defaults above and sets this itself.)
+if 'gunicorn' in sys.modules:
+    os.environ.setdefault('DASH_DATA_LOAD', 'eager')
@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from associations import AssociationMatrix, count_pairs
+from cleaning import CHUNK_SIZE, DIAG_COLUMNS, RAW_CSV, median_from_counts, scan_diag_columns, write_cleaned
+from cohort_index import cohort_index
+from combination_profile import build_profile
+from dataset import CLEANED_CSV, DATA_DIR, dataset_version, file_sha256, load_dataset, optimize_dtypes
+from drug_cube import build_cube
+
+logger = logging.getLogger(__name__)
+
+INGEST_DIR = os.environ.get('DIABETES_INGEST_DIR', os.path.join(DATA_DIR, 'ingest'))
+STATE_FILE = 'aggregates.pkl'
+
+
+def state_path(store_dir=INGEST_DIR):
+    return os.path.join(store_dir, STATE_FILE)
+
+
+def load_state(store_dir=INGEST_DIR):
+    with open(state_path(store_dir), 'rb') as f:
+        return pickle.load(f)
+
+
+def save_state(state, store_dir=INGEST_DIR):
+    path = state_path(store_dir)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def build_aggregates(df):
+    return {'cube': build_cube(df), 'profile': build_profile(df), 'pair_counts': count_pairs(df)}
+
+
+def merge_aggregates(current, batch):
+    return {name: current[name].merge(batch[name]) for name in current}
+
+
+def merge_histograms(current, batch):
+    return {column: current[column].add(batch[column], fill_value=0) for column in current}
+
+
+def append_rows(df, batch):
+    """Concatenate two frames, keeping categorical columns categorical (with the union of their categories)."""
+    columns = {}
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([df[column], batch[column].astype('category')], sort_categories=True)
+        else:
+            columns[column] = pd.concat([df[column], batch[column]], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def init_store(csv_path=CLEANED_CSV, raw_path=RAW_CSV, store_dir=INGEST_DIR):
+    """Start an ingest store from the current cleaned dataset.
+
+    The diag value histograms that later batches' medians are computed from
+    come from the raw extract; without it they are taken from the cleaned file,
+    where the imputed medians are already counted in.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    df = load_dataset(csv_path)
+    if os.path.exists(raw_path):
+        _, _, _, histograms = scan_diag_columns(raw_path)
+    else:
+        logger.warning('%s not found, diag histograms include the imputed values', raw_path)
+        histograms = {column: df[column].value_counts() for column in DIAG_COLUMNS}
+
+    state = {
+        'base_version': df.attrs['version'],
+        'version': df.attrs['version'],
+        'rows': len(df),
+        'batches': [],
+        'diag_histograms': histograms,
+        'medians': {column: median_from_counts(histogram) for column, histogram in histograms.items()},
+        **build_aggregates(df),
+    }
+    save_state(state, store_dir)
+    return state
+
+
+def ingest_batch(raw_path, store_dir=INGEST_DIR, chunksize=CHUNK_SIZE):
+    """Clean a new raw extract and merge it into the store without touching earlier rows.
+
+    The batch's missing diag codes are imputed with the medians of all data
+    ingested so far including this batch; rows of earlier batches keep the
+    medians they were cleaned with. Ingesting the same file twice is a no-op.
+    Only one process should ingest into a store at a time.
+    """
+    start = time.perf_counter()
+    state = load_state(store_dir)
+    digest = file_sha256(raw_path)
+    if any(batch['sha256'] == digest for batch in state['batches']):
+        logger.info('%s was already ingested', raw_path)
+        return None
+
+    rows, question_marks, v_codes, histograms = scan_diag_columns(raw_path, chunksize)
+    histograms = merge_histograms(state['diag_histograms'], histograms)
+    medians = {column: median_from_counts(histogram) for column, histogram in histograms.items()}
+
+    name = f'batch-{len(state["batches"]) + 1:04d}.csv'
+    write_cleaned(raw_path, os.path.join(store_dir, name), medians, chunksize)
+    batch = optimize_dtypes(pd.read_csv(os.path.join(store_dir, name)))
+
+    state['version'] = hashlib.sha256((state['version'] + digest).encode('utf-8')).hexdigest()[:12]
+    state['rows'] += rows
+    state['batches'].append({'file': name, 'sha256': digest, 'rows': rows, 'source': os.path.abspath(raw_path),
+                             'ingested': time.time()})
+    state['diag_histograms'] = histograms
+    state['medians'] = medians
+    state.update(merge_aggregates({key: state[key] for key in ('cube', 'profile', 'pair_counts')},
+                                  build_aggregates(batch)))
+    save_state(state, store_dir)
+    return {'version': state['version'], 'rows': rows, 'total_rows': state['rows'], 'question_marks': question_marks,
+            'v_codes': v_codes, 'medians': medians, 'seconds': time.perf_counter() - start}
+
+
+def current_version(csv_path=CLEANED_CSV, store_dir=INGEST_DIR):
+    """The version a fresh LiveDataset would serve, read from the cache metadata and the store only."""
+    version = dataset_version(csv_path)
+    try:
+        state = load_state(store_dir)
+    except OSError:
+        return version
+    return state['version'] if state['base_version'] == version else version
+
+
+class LiveDataset:
+    """The cleaned dataset and its aggregates, following batches ingested into a store.
+
+    ``refresh()`` is cheap to call often: it looks at the store at most every
+    ``check_interval`` seconds and, when batches were added, reads only those
+    batch files and swaps in the merged aggregates from the store. Without a
+    store it serves the cleaned dataset as is.
+    """
+
+    def __init__(self, csv_path=CLEANED_CSV, store_dir=INGEST_DIR, check_interval=5):
+        self.store_dir = store_dir
+        self.check_interval = check_interval
+        self.df = load_dataset(csv_path)
+        self.version = self.df.attrs['version']
+        self.cube = self.profile = self.pair_counts = None
+        self._associations = None
+        self._batches = 0
+        self._mtime = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        if not self.refresh(force=True):
+            self.cube, self.profile, self.pair_counts = (build_aggregates(self.df)[name]
+                                                         for name in ('cube', 'profile', 'pair_counts'))
+
+    @property
+    def associations(self):
+        associations = self._associations
+        if associations is None or associations[0] is not self.pair_counts:
+            associations = self._associations = (self.pair_counts, AssociationMatrix.from_counts(self.pair_counts))
+        return associations[1]
+
+    @property
+    def cohorts(self):
+        """CohortIndex of the current rows, built on first use after each refresh."""
+        return cohort_index(self.df)
+
+    def refresh(self, force=False):
+        """Pick up newly ingested batches; True when the data changed."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(state_path(self.store_dir)).st_mtime_ns
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            state = load_state(self.store_dir)
+            self._mtime = mtime
+            if state['base_version'] != self.df.attrs['version'] and self._batches == 0:
+                logger.warning('Ingest store %s was built from another dataset version, ignoring it', self.store_dir)
+                return False
+            if state['version'] == self.version and self.cube is not None:
+                return False
+
+            df = self.df
+            for batch in state['batches'][self._batches:]:
+                df = append_rows(df, optimize_dtypes(pd.read_csv(os.path.join(self.store_dir, batch['file']))))
+            df.attrs['version'] = state['version']
+            self.df, self.cube, self.profile, self.pair_counts = (df, state['cube'], state['profile'],
+                                                                  state['pair_counts'])
+            self.version = state['version']
+            self._batches = len(state['batches'])
+            logger.info('Loaded dataset version %s (%d rows)', self.version, len(df))
+            return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Append new encounter extracts to the dashboards\' data.')
+    parser.add_argument('--store', default=INGEST_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    init = subparsers.add_parser('init', help='start a store from the current cleaned dataset')
+    init.add_argument('--csv', default=CLEANED_CSV)
+    init.add_argument('--raw', default=RAW_CSV)
+    add = subparsers.add_parser('add', help='clean raw batch files and merge them into the store')
+    add.add_argument('batches', nargs='+')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'init':
+        state = init_store(args.csv, args.raw, args.store)
+        print(f"Initialized {args.store} at version {state['version']} ({state['rows']} rows)")
+    else:
+        for path in args.batches:
+            report = ingest_batch(path, args.store)
+            if report is not None:
+                print(f"{path}: {report['rows']} rows in {report['seconds']:.2f}s, "
+                      f"now {report['total_rows']} rows at version {report['version']}")
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from metrics import collect_stages, current_callback, observe_stages
+
+logger = logging.getLogger(__name__)
+
+JOB_DB = os.environ.get('DASH_JOB_DB', os.path.join(tempfile.gettempdir(), 'dashboard_jobs.sqlite'))
+# Per server process. Jobs get their data from the request thread, so a worker
+# holds only the plotting libraries, not a copy of the dataset.
+JOB_WORKERS = int(os.environ.get('DASH_JOB_WORKERS', '2'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+'''
+
+
+def job_id(key):
+    """Jobs are addressed by their key, so identical requests map to the same job."""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+class JobStore:
+    """SQLite table of job state, progress and JSON results shared by all processes."""
+
+    def __init__(self, path=JOB_DB):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def claim(self, job, stale_after):
+        """Insert a queued row for ``job``; False if a live or finished job already owns it."""
+        now = time.time()
+        with self._connect() as connection:
+            # Failed jobs and running jobs whose worker stopped reporting can be retried.
+            connection.execute('DELETE FROM jobs WHERE id = ? AND (state = ? OR (state IN (?, ?) AND updated < ?))',
+                               (job, FAILED, QUEUED, RUNNING, now - stale_after))
+            cursor = connection.execute('INSERT OR IGNORE INTO jobs (id, state, created, updated) VALUES (?, ?, ?, ?)',
+                                        (job, QUEUED, now, now))
+            return cursor.rowcount == 1
+
+    def update(self, job, **fields):
+        fields['updated'] = time.time()
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as connection:
+            connection.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job))
+
+    def finish(self, job, result):
+        import plotly
+
+        self.update(job, state=DONE, progress=1.0, message='Done',
+                    result=json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+
+    def fail(self, job, error):
+        self.update(job, state=FAILED, error=error)
+
+    def get(self, job):
+        with self._connect() as connection:
+            row = connection.execute('SELECT state, progress, message, result, error FROM jobs WHERE id = ?',
+                                     (job,)).fetchone()
+        if row is None:
+            return None
+        state, progress, message, result, error = row
+        return {'id': job, 'state': state, 'progress': progress, 'message': message,
+                'result': json.loads(result) if result is not None else None, 'error': error}
+
+    def purge(self, older_than):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM jobs WHERE updated < ? AND state IN (?, ?)',
+                               (time.time() - older_than, DONE, FAILED))
+
+
+def _execute(path, job, task, args):
+    store = JobStore(path)
+    store.update(job, state=RUNNING)
+
+    def progress(fraction, message=''):
+        store.update(job, progress=fraction, message=message)
+
+    try:
+        with collect_stages() as stages:
+            result = task(*args, progress=progress)
+        store.finish(job, result)
+    except Exception:
+        store.fail(job, traceback.format_exc())
+        raise
+    return result, stages
+
+
+class JobQueue:
+    """Runs expensive callback work in a process pool and tracks it in a JobStore.
+
+    ``submit(key, task, *args)`` returns a job id straight away. ``task`` must
+    be a module-level function accepting a ``progress(fraction, message)``
+    keyword and returning something JSON-serializable; it should live in a
+    module that is cheap to import (not a dashboard), since each worker
+    imports it, and get the data it needs through ``args``. Requests with the
+    same key share one computation, across threads and across server
+    processes, and finished results are served from the store until they are
+    older than ``ttl`` seconds.
+
+    The stages a task times with ``metrics.stage`` are recorded in the
+    submitting process under the submitting callback, along with a 'job'
+    stage from submission to completion.
+    """
+
+    def __init__(self, path=JOB_DB, max_workers=JOB_WORKERS, stale_after=600, ttl=24 * 3600):
+        self.store = JobStore(path)
+        self.max_workers = max_workers
+        self.stale_after = stale_after
+        self.ttl = ttl
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created lazily per process: a pool inherited through a fork (e.g. gunicorn's
+        # preload) has no live workers in the child. Workers are spawned rather than
+        # forked so they never inherit locks held by other request threads.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, key, task, *args, on_done=None):
+        """Job id of ``task(*args)``; ``on_done(result)`` runs in this process if it is the one computing it."""
+        job = job_id(key)
+        self.store.purge(self.ttl)
+        if self.store.claim(job, self.stale_after):
+            callback, submitted = current_callback(), time.perf_counter()
+            future = self._pool().submit(_execute, self.store.path, job, task, args)
+            future.add_done_callback(lambda f: self._check(job, f, callback, submitted, on_done))
+        return job
+
+    def complete(self, key, result):
+        """Record ``result`` as the finished job for ``key`` without running it, e.g. when it was cached."""
+        job = job_id(key)
+        self.store.claim(job, self.stale_after)
+        self.store.finish(job, result)
+        return job
+
+    def _check(self, job, future, callback, submitted, on_done):
+        # A worker killed mid-task never reaches store.fail itself.
+        error = future.exception() if not future.cancelled() else 'cancelled'
+        if error is not None:
+            logger.warning('Job %s failed: %r', job, error)
+            status = self.store.get(job)
+            if status is not None and status['state'] != FAILED:
+                self.store.fail(job, repr(error))
+            return
+        result, stages = future.result()
+        observe_stages(callback, stages + [('job', time.perf_counter() - submitted)])
+        if on_done is not None:
+            on_done(result)
+
+    def status(self, job):
+        return self.store.get(job)
+
+
+def progress_bar(status):
+    """Progress element for a job status, for the dashboards' status area."""
+    import dash_html_components as html
+
+    if status is None:
+        return html.Div('The result has expired, please run the analysis again.')
+    if status['state'] == FAILED:
+        return html.Div('The analysis failed, please try again.', style={'color': 'firebrick'})
+    return html.Div([
+        html.Progress(value=str(int(status['progress'] * 100)), max='100', style={'width': '300px'}),
+        html.Div(status['message'] or 'Waiting for a worker...')
+    ], style={'textAlign': 'center', 'margin': '20px'})
@@ -0,0 +1,66 @@
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.svm import LinearSVC
+
+
+def unique_rows(X):
+    """Return the distinct rows of X and, for every row, the index of its pattern.
+
+    One-hot medication matrices are binary, so rows are bit-packed first and
+    compared as a few bytes each instead of as float vectors.
+    """
+    if sparse.issparse(X):
+        X = X.toarray()
+    X = np.asarray(X)
+    if X.dtype == bool or np.isin(X, (0, 1)).all():
+        packed = np.packbits(X.astype(bool), axis=1)
+        keys = np.ascontiguousarray(packed).view(np.dtype((np.void, packed.shape[1]))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return X[first].astype(np.float64), inverse.ravel()
+    patterns, inverse = np.unique(X.astype(np.float64), axis=0, return_inverse=True)
+    return patterns, inverse.ravel()
+
+
+class DedupLinearSVM(ClassifierMixin, BaseEstimator):
+    """Linear SVM trained on weighted unique feature patterns.
+
+    Ten medication columns give at most a few hundred distinct one-hot rows, so
+    identical (pattern, label) pairs are collapsed into a single sample whose
+    weight is its count, and the primal problem is solved by liblinear on a
+    sparse matrix. Training cost depends on the number of distinct patterns,
+    not on the number of patients.
+    """
+
+    def __init__(self, C=1.0, loss='squared_hinge', tol=1e-4, max_iter=1000):
+        self.C = C
+        self.loss = loss
+        self.tol = tol
+        self.max_iter = max_iter
+
+    def fit(self, X, y):
+        patterns, inverse = unique_rows(X)
+        self.classes_, y_codes = np.unique(np.asarray(y), return_inverse=True)
+        n_classes = len(self.classes_)
+
+        counts = np.bincount(inverse * n_classes + y_codes, minlength=len(patterns) * n_classes)
+        nonzero = np.flatnonzero(counts)
+        pattern_index, class_index = np.divmod(nonzero, n_classes)
+
+        self.n_patterns_ = len(patterns)
+        self.n_samples_ = len(nonzero)
+        self.model_ = LinearSVC(C=self.C, loss=self.loss, dual=self.loss == 'hinge', tol=self.tol,
+                                max_iter=self.max_iter)
+        self.model_.fit(sparse.csr_matrix(patterns[pattern_index]), self.classes_[class_index],
+                        sample_weight=counts[nonzero])
+        self.coef_ = self.model_.coef_
+        self.intercept_ = self.model_.intercept_
+        return self
+
+    def decision_function(self, X):
+        patterns, inverse = unique_rows(X)
+        return self.model_.decision_function(sparse.csr_matrix(patterns))[inverse]
+
+    def predict(self, X):
+        patterns, inverse = unique_rows(X)
+        return self.model_.predict(sparse.csr_matrix(patterns))[inverse]
@@ -0,0 +1,223 @@
+import argparse
+import functools
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from drug_cube import MEDICATIONS
+
+# Finer than the page's 500 ms interval, so the reported latency is close to when the job finished.
+POLL_INTERVAL = 0.1
+
+
+def fetch_dependencies(base_url):
+    with urllib.request.urlopen(base_url + '/_dash-dependencies') as response:
+        return json.load(response)
+
+
+def find_callback(dependencies, output_id):
+    for dependency in dependencies:
+        if output_id in dependency['output']:
+            return dependency
+    raise ValueError(f'No callback writes to {output_id}')
+
+
+def request_body(dependency, values, changed):
+    """JSON body of the POST the browser sends to /_dash-update-component."""
+    output = dependency['output']
+    names = output.strip('.').split('...') if output.startswith('..') else [output]
+    outputs = [{'id': name.rsplit('.', 1)[0], 'property': name.rsplit('.', 1)[1]} for name in names]
+    return {
+        'output': output,
+        'outputs': outputs if output.startswith('..') else outputs[0],
+        'inputs': [{'id': i['id'], 'property': i['property'], 'value': values.get(i['id'])}
+                   for i in dependency['inputs']],
+        'state': [],
+        'changedPropIds': [changed],
+    }
+
+
+def post_callback(base_url, body, timeout=60):
+    request = urllib.request.Request(base_url + '/_dash-update-component', data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def output_value(response, component, prop):
+    """A property set by a callback response, in either the single or the multi-output format."""
+    outputs = response['response']
+    if 'props' in outputs:
+        return outputs['props'].get(prop)
+    return outputs.get(component, {}).get(prop)
+
+
+def wait_for_job(base_url, poll, job, timeout=120):
+    """Poll a relationship job like the page does until its figures are there."""
+    deadline = time.perf_counter() + timeout
+    for n_intervals in itertools.count(1):
+        response = post_callback(base_url, request_body(poll, {'relationship-job': job,
+                                                               'relationship-poll': n_intervals},
+                                                        'relationship-poll.n_intervals'))
+        if output_value(response, 'relationship-poll', 'disabled'):
+            if output_value(response, 'relationship-plot', 'children') is None:
+                raise OSError(f'Job {job} failed or expired')
+            return
+        if time.perf_counter() >= deadline:
+            raise OSError(f'Job {job} did not finish within {timeout}s')
+        time.sleep(POLL_INTERVAL)
+
+
+def build_actions(base_url, callback):
+    """One function per simulated interaction; each returns once the page would show its result."""
+    dependencies = fetch_dependencies(base_url)
+    if callback == 'distribution':
+        dependency = find_callback(dependencies, 'drug1-plot')
+        return [functools.partial(post_callback, base_url,
+                                  request_body(dependency, {'drug1-dropdown': drug}, 'drug1-dropdown.value'))
+                for drug in MEDICATIONS]
+
+    # "Show Relationship" only submits a job; the figures arrive through the polling callback.
+    submit = find_callback(dependencies, 'relationship-job')
+    poll = find_callback(dependencies, 'relationship-plot')
+
+    def relationship(drug1, drug2):
+        response = post_callback(base_url, request_body(
+            submit, {'relationship-button': 1, 'drug1-dropdown': drug1, 'drug2-dropdown': drug2},
+            'relationship-button.n_clicks'))
+        job = output_value(response, 'relationship-job', 'data')
+        if job is None:
+            raise OSError(f'No job was submitted for {drug1} and {drug2}')
+        wait_for_job(base_url, poll, job)
+
+    return [functools.partial(relationship, drug1, drug2) for drug1, drug2 in itertools.permutations(MEDICATIONS, 2)]
+
+
+def run_load(actions, concurrency, duration, repeat=True):
+    """Run the interactions from ``concurrency`` threads for ``duration`` seconds, timing each to completion.
+
+    With ``repeat=False`` every action runs at most once, and the run ends
+    early when they are used up.
+    """
+    deadline = time.perf_counter() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    pending = itertools.cycle(actions) if repeat else iter(actions)
+
+    def client():
+        local = []
+        while time.perf_counter() < deadline:
+            with lock:
+                action = next(pending, None)
+            if action is None:
+                break
+            start = time.perf_counter()
+            try:
+                action()
+                local.append(time.perf_counter() - start)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else None,
+    }
+
+
+def wait_until_ready(base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            fetch_dependencies(base_url)
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f'{base_url} did not come up within {timeout}s')
+
+
+def spawn_server(app, port, workers, threads, state_dir):
+    """Start gunicorn with no figure cache, an empty report bundle and a job store of its own in ``state_dir``."""
+    env = dict(os.environ, DASH_BIND=f'127.0.0.1:{port}', DASH_WORKERS=str(workers), DASH_THREADS=str(threads),
+               OLAP_FIGURE_CACHE_MB='0', DASH_JOB_DB=os.path.join(state_dir, 'jobs.sqlite'),
+               DIABETES_REPORT_DIR=state_dir)
+    for name in ('OLAP_FIGURE_CACHE_DIR', 'OLAP_WARM_FIGURES'):
+        env.pop(name, None)
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', f'{app}:server'],
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure dashboard callback throughput.')
+    parser.add_argument('--url', help='load an already running server instead of spawning gunicorn')
+    parser.add_argument('--app', default='OLAP', choices=['OLAP', 'OlapClick'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='worker counts to spawn gunicorn with, one run each')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, help='client threads (default: 2 x workers x threads)')
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--callback', choices=['distribution', 'relationship'], default='distribution')
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+
+    # A finished relationship job is served from the job store to every later request for its pair, so each
+    # pair is requested once per run; distribution figures are re-rendered as the spawned server caches nothing.
+    repeat = args.callback == 'distribution'
+
+    def measure(actions, concurrency):
+        # Short warm-up so worker start-up and first renders do not skew the measurement; without repeats it
+        # uses up its own actions and the measurement gets the rest.
+        warm_up = actions if repeat else actions[:concurrency]
+        run_load(warm_up, concurrency, 2, repeat)
+        return run_load(actions if repeat else actions[len(warm_up):], concurrency, args.duration, repeat)
+
+    results = []
+    if args.url:
+        # The server's own caches and job store stay in place, so this measures what its users see.
+        results.append(measure(build_actions(args.url, args.callback), args.concurrency or 8))
+    else:
+        base_url = f'http://127.0.0.1:{args.port}'
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as state_dir:
+                server = spawn_server(args.app, args.port, workers, args.threads, state_dir)
+                try:
+                    wait_until_ready(base_url)
+                    result = measure(build_actions(base_url, args.callback),
+                                     args.concurrency or 2 * workers * args.threads)
+                    result['workers'] = workers
+                    results.append(result)
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+MEDICATIONS = ['metformin', 'glipizide', 'glyburide', 'insulin', 'repaglinide',
+               'nateglinide', 'chlorpropamide', 'glimepiride', 'acetohexamide', 'tolbutamide']
+
+# Every medication column of diabetic_data.csv, in file order.
+ALL_MEDICATIONS = [
+    'metformin', 'repaglinide', 'nateglinide', 'chlorpropamide', 'glimepiride', 'acetohexamide',
+    'glipizide', 'glyburide', 'tolbutamide', 'pioglitazone', 'rosiglitazone', 'acarbose', 'miglitol',
+    'troglitazone', 'tolazamide', 'examide', 'citoglipton', 'insulin', 'glyburide-metformin',
+    'glipizide-metformin', 'glimepiride-pioglitazone', 'metformin-rosiglitazone', 'metformin-pioglitazone'
+]
+
+# Code i stands for USAGE_LEVELS[i] and -1 for a missing or unknown value. Codes
+# are only comparable under the same LEVELS_VERSION, so bump it when this changes.
+USAGE_LEVELS = ['No', 'Steady', 'Up', 'Down']
+LEVELS_VERSION = 1
+MISSING = -1
+
+# Alphabetical order, i.e. the codes LabelEncoder assigns to the usage levels.
+LABEL_ORDER = sorted(USAGE_LEVELS)
+# Dose direction order: no drug, decreased, unchanged, increased.
+ORDINAL_ORDER = ['No', 'Down', 'Steady', 'Up']
+
+BITS_PER_DRUG = 2
+DRUGS_PER_BYTE = 8 // BITS_PER_DRUG
+
+
+class VersionedCache:
+    """Results computed from a DataFrame, kept for the ``max_entries`` most recent keys.
+
+    Keys start with ``df.attrs['version']``, but pandas copies ``attrs`` onto
+    slices and filtered frames, so an entry also holds a weak reference to the
+    frame it was computed from and only serves that very frame. Another frame
+    of the same version gets a fresh result, which is kept only once the
+    first frame is gone. Frames without a version are never cached.
+    """
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, df, compute, *key):
+        version = df.attrs.get('version')
+        if version is None:
+            return compute()
+        key = (version,) + key
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is df:
+                return entry[1]
+        result = compute()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0]() is None:
+                self._entries.pop(key, None)
+                # Only recent versions are worth keeping: older ones have been replaced by ingested batches.
+                while len(self._entries) >= self.max_entries:
+                    self._entries.popitem(last=False)
+                self._entries[key] = (weakref.ref(df), result)
+        return result
+
+
+_cache = VersionedCache()
+
+
+def encode_column(series, levels):
+    """Return int8 category codes for a column, -1 for missing or unknown values."""
+    return pd.Categorical(series, categories=levels).codes.astype(np.int8)
+
+
+def _lookup(order, missing=MISSING):
+    """Table mapping canonical codes to positions in ``order``; index -1 (missing) hits the last entry."""
+    return np.array([order.index(level) if level in order else missing for level in USAGE_LEVELS] + [missing],
+                    dtype=np.int64)
+
+
+class MedicationCodes:
+    """The medication columns as one int8 matrix of usage level codes (see USAGE_LEVELS).
+
+    A categorical column already stores int8 codes, but each with its own
+    level order depending on the values seen; here the mapping is fixed, so
+    codes from different frames and batches line up. The adapters give the
+    views the analyses need (label, ordinal, one-hot, packed) without going
+    back to the strings.
+    """
+
+    def __init__(self, codes, columns, version=LEVELS_VERSION):
+        if version != LEVELS_VERSION:
+            raise ValueError(f'Codes use level mapping version {version}, expected {LEVELS_VERSION}')
+        self.codes = codes
+        self.columns = list(columns)
+        self.version = version
+        self._index = {column: i for i, column in enumerate(self.columns)}
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        columns = [column for column in (columns or ALL_MEDICATIONS) if column in df.columns]
+        # Column-major, so every per-drug view is contiguous.
+        codes = np.empty((len(df), len(columns)), dtype=np.int8, order='F')
+        for i, column in enumerate(columns):
+            codes[:, i] = encode_column(df[column], USAGE_LEVELS)
+        return cls(codes, columns)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def column(self, drug):
+        return self.codes[:, self._index[drug]]
+
+    def take(self, rows):
+        return MedicationCodes(self.codes[rows], self.columns)
+
+    def decode(self, drug):
+        return pd.Categorical.from_codes(self.column(drug), USAGE_LEVELS)
+
+    def level_counts(self, drug):
+        codes = self.column(drug)
+        return np.bincount(codes[codes >= 0], minlength=len(USAGE_LEVELS))
+
+    def present_levels(self, drug):
+        """Levels the column takes, alphabetically, like the dummy columns of ``pd.get_dummies``."""
+        counts = self.level_counts(drug)
+        return [level for level in LABEL_ORDER if counts[USAGE_LEVELS.index(level)] > 0]
+
+    def label(self, drug):
+        """Codes in LABEL_ORDER (what LabelEncoder gives when all four levels occur), -1 for missing."""
+        return _lookup(LABEL_ORDER)[self.column(drug)].astype(np.int8)
+
+    def ordinal(self, drug):
+        """Codes in ORDINAL_ORDER, -1 for missing."""
+        return _lookup(ORDINAL_ORDER)[self.column(drug)].astype(np.int8)
+
+    def one_hot(self, columns=None, levels=None, drop_first=False, sparse_output=False, dtype=np.float64):
+        """Dummy columns ``<drug>_<level>`` and their names, as ``pd.get_dummies`` would build them.
+
+        ``levels`` maps a drug to the levels to emit (default: the levels it
+        takes here); with ``drop_first`` the first of them is left out. Missing
+        values and levels not emitted are all zeros. ``sparse_output`` returns a
+        CSR matrix.
+        """
+        columns = columns or self.columns
+        names = []
+        positions = np.empty((len(self), len(columns)), dtype=np.int64)
+        for i, drug in enumerate(columns):
+            emitted = list(levels[drug] if levels is not None else self.present_levels(drug))[int(drop_first):]
+            position = _lookup(emitted)[self.column(drug)]
+            positions[:, i] = np.where(position >= 0, position + len(names), MISSING)
+            names += [f'{drug}_{level}' for level in emitted]
+
+        rows, cells = np.nonzero(positions >= 0)
+        if sparse_output:
+            matrix = sparse.csr_matrix((np.ones(len(rows), dtype=dtype), (rows, positions[rows, cells])),
+                                       shape=(len(self), len(names)))
+        else:
+            matrix = np.zeros((len(self), len(names)), dtype=dtype)
+            matrix[rows, positions[rows, cells]] = 1
+        return matrix, names
+
+    def combinations(self, columns=MEDICATIONS):
+        """Every row's levels of ``columns`` as one integer, 2 bits per drug; missing counts as 'No'."""
+        packed = np.zeros(len(self), dtype=np.uint32)
+        for i, drug in enumerate(columns):
+            packed |= np.maximum(self.column(drug), 0).astype(np.uint32) << (BITS_PER_DRUG * i)
+        return packed
+
+    def pack(self):
+        """2-bit packed copy, four drugs per byte; missing values are stored as 'No'."""
+        padded = np.zeros((len(self), -(-len(self.columns) // DRUGS_PER_BYTE) * DRUGS_PER_BYTE), dtype=np.uint8)
+        padded[:, :len(self.columns)] = np.maximum(self.codes, 0)
+        packed = np.zeros((len(self), padded.shape[1] // DRUGS_PER_BYTE), dtype=np.uint8)
+        for shift in range(DRUGS_PER_BYTE):
+            packed |= padded[:, shift::DRUGS_PER_BYTE] << (BITS_PER_DRUG * shift)
+        return packed
+
+    @classmethod
+    def unpack(cls, packed, columns):
+        codes = np.empty((len(packed), len(columns)), dtype=np.int8, order='F')
+        for i in range(len(columns)):
+            codes[:, i] = (packed[:, i // DRUGS_PER_BYTE] >> (BITS_PER_DRUG * (i % DRUGS_PER_BYTE))) & 0b11
+        return cls(codes, columns)
+
+
+def medication_codes(df):
+    """MedicationCodes of every medication column in ``df``, cached per frame and dataset version."""
+    return _cache.get(df, lambda: MedicationCodes.from_frame(df))
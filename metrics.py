@@ -0,0 +1,217 @@
+import bisect
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+PAYLOAD_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+_lock = threading.Lock()
+_context = threading.local()
+_histograms = {}
+
+PROFILE_DIR = os.environ.get('DASH_PROFILE_DIR')
+PROFILE_HEADER = 'X-Dash-Profile'
+SLOW_CALLBACK_SECONDS = float(os.environ.get('DASH_SLOW_CALLBACK_SECONDS', 1.0))
+_profiling = {'enabled': bool(os.environ.get('DASH_PROFILE'))}
+
+
+class Histogram:
+    """Prometheus-style histogram: per-bucket counts plus running sum, count and max."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+
+def observe(metric, labels, value, buckets):
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram(buckets)
+        _histograms[key].observe(value)
+
+
+def current_callback():
+    return getattr(_context, 'callback', None) or 'none'
+
+
+@contextmanager
+def stage(name):
+    """Time a named stage of the running callback, e.g. ``with stage('savefig'):``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stages = getattr(_context, 'stages', None)
+        if stages is not None:
+            stages.append((name, elapsed))
+        else:
+            observe('dash_stage_seconds', {'callback': current_callback(), 'stage': name}, elapsed, LATENCY_BUCKETS)
+
+
+@contextmanager
+def collect_stages():
+    """Collect the stages timed on this thread as (name, seconds) pairs instead of recording them.
+
+    For work done on behalf of a callback in another process, e.g. a job
+    worker, whose histograms /metrics never sees: the serving process records
+    the pairs with observe_stages.
+    """
+    _context.stages = stages = []
+    try:
+        yield stages
+    finally:
+        _context.stages = None
+
+
+def observe_stages(callback, stages):
+    for name, seconds in stages:
+        observe('dash_stage_seconds', {'callback': callback, 'stage': name}, seconds, LATENCY_BUCKETS)
+
+
+def _should_profile():
+    if not PROFILE_DIR:
+        return False
+    from flask import has_request_context, request
+
+    if has_request_context() and request.headers.get(PROFILE_HEADER):
+        return True
+    return _profiling['enabled']
+
+
+def _dump_profile(profiler, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f'{name}-{os.getpid()}-{time.time_ns()}.prof')
+    profiler.dump_stats(path)
+    logger.info('Wrote profile of %s to %s', name, path)
+
+
+def instrument_callback(callback):
+    """Record latency of a Dash callback, optionally under cProfile; instrument records its response size."""
+    from flask import g, has_request_context
+
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        _context.callback = name
+        if has_request_context():
+            g.dash_callback = name
+        profiler = cProfile.Profile() if _should_profile() else None
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                return profiler.runcall(callback, *args, **kwargs)
+            return callback(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            observe('dash_callback_seconds', {'callback': name}, elapsed, LATENCY_BUCKETS)
+            _context.callback = None
+            if elapsed > SLOW_CALLBACK_SECONDS:
+                logger.warning('Slow callback %s%r took %.2fs', name, args, elapsed)
+            if profiler is not None:
+                _dump_profile(profiler, name)
+    return wrapper
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+def render_prometheus():
+    descriptions = {
+        'dash_callback_seconds': 'Dash callback latency in seconds.',
+        'dash_stage_seconds': 'Latency of named stages inside Dash callbacks in seconds.',
+        'dash_callback_payload_bytes': 'Size of Dash callback responses in bytes.',
+    }
+    with _lock:
+        snapshot = sorted((key, (list(h.counts), h.sum, h.count, h.buckets)) for key, h in _histograms.items())
+
+    lines = []
+    seen = set()
+    for (metric, labels), (counts, total, count, buckets) in snapshot:
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f'# HELP {metric} {descriptions.get(metric, metric)}')
+            lines.append(f'# TYPE {metric} histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append(f'{metric}_bucket{_format_labels(labels, le=bound)} {cumulative}')
+        lines.append(f'{metric}_sum{_format_labels(labels)} {total}')
+        lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def payload_summary():
+    with _lock:
+        return {
+            dict(labels)['callback']: {'count': h.count, 'mean': h.sum / h.count, 'max': h.max}
+            for (metric, labels), h in _histograms.items()
+            if metric == 'dash_callback_payload_bytes' and h.count
+        }
+
+
+def instrument(app):
+    """Time every callback registered on ``app`` afterwards and serve the results at /metrics.
+
+    Metrics are kept per process; with several gunicorn workers each one
+    reports its own histograms. When DASH_PROFILE_DIR is set, callbacks are
+    run under cProfile and dumped into that directory for requests carrying an
+    X-Dash-Profile header, or for every request after /metrics/profile?enabled=1.
+    """
+    from flask import Response, g, jsonify, request
+
+    register = app.callback
+
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+
+        def wrap(func):
+            decorator(instrument_callback(func))
+            return func
+        return wrap
+
+    app.callback = callback
+
+    @app.server.after_request
+    def record_payload(response):
+        # Measured on the body Dash already serialized instead of serializing the result a second time.
+        name = g.pop('dash_callback', None)
+        if name is not None:
+            size = response.calculate_content_length()
+            if size is not None:
+                observe('dash_callback_payload_bytes', {'callback': name}, size, PAYLOAD_BUCKETS)
+                logger.debug('%s returned %d bytes', name, size)
+        return response
+
+    @app.server.route('/metrics')
+    def metrics():
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    if PROFILE_DIR:
+        @app.server.route('/metrics/profile')
+        def profile():
+            if 'enabled' in request.args:
+                _profiling['enabled'] = request.args['enabled'] not in ('0', 'false', 'off')
+            return jsonify(enabled=_profiling['enabled'], directory=PROFILE_DIR)
+
+    return app
@@ -0,0 +1,169 @@
+import base64
+import io
+
+import report
+from metrics import stage
+from startup import lazy_import
+
+# Tasks of the dashboards' drug-pair jobs. They live here rather than in OLAP
+# or OlapClick because a job worker imports the module of its task: importing a
+# dashboard would build its app and load the whole dataset in every worker.
+# The request thread passes in the little data a pair needs instead.
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+px = lazy_import('plotly.express')
+go = lazy_import('plotly.graph_objects')
+combination_stats = lazy_import('combination_stats')
+drug_cube = lazy_import('drug_cube')
+
+
+def encode_figure(fig):
+    # Figures are created per call instead of through pyplot's global state, so
+    # threaded workers can render concurrently.
+    buf = io.BytesIO()
+    with stage('savefig'):
+        fig.savefig(buf, format='png')
+    buf.seek(0)
+    img_bytes = buf.getvalue()
+    buf.close()
+
+    with stage('base64'):
+        encoded_image = base64.b64encode(img_bytes).decode('utf-8')
+    return 'data:image/png;base64,{}'.format(encoded_image)
+
+
+def relationship_image(frame, drug1, drug2):
+    with stage('lineplot'):
+        fig = report.relationship_figure(frame, drug1, drug2)
+    return encode_figure(fig)
+
+
+def combination_image(cube, drug1, drug2):
+    with stage('combination_statistics'):
+        results_df = combination_stats.pair_statistics(cube, drug1, drug2)
+    with stage('barplot'):
+        fig = report.combination_figure(results_df, drug1, drug2)
+    return encode_figure(fig)
+
+
+def pair_images(drug1, drug2, frame, cube, images, progress):
+    """OLAP's relationship and combination images of a pair; ``images`` holds those the caller already has.
+
+    ``frame`` holds the rows' two drug columns (categorical, so it pickles
+    small) and ``cube`` the DrugCube of those rows; either may be None when
+    its image is in ``images``.
+    """
+    images = dict(images)
+    if 'relationship' not in images:
+        progress(0.1, f'Plotting {drug2.capitalize()} against {drug1.capitalize()} usage...')
+        images['relationship'] = relationship_image(frame, drug1, drug2)
+    if 'analysis' not in images:
+        progress(0.6, 'Plotting readmitted status by combination...')
+        images['analysis'] = combination_image(cube, drug1, drug2)
+    return images
+
+
+def distribution_summary_figure(cube, drug1, drug2):
+    # Box statistics are computed server-side from the cube instead of shipping every row.
+    summary = cube.distribution_summary(drug1, drug2)
+    fig = go.Figure()
+    for row in summary.itertuples():
+        fig.add_trace(go.Box(
+            x=[row.level],
+            q1=[row.q1],
+            median=[row.median],
+            q3=[row.q3],
+            lowerfence=[row.lowerfence],
+            upperfence=[row.upperfence],
+            mean=[row.mean],
+            name=f'{row.level} (n={row.count})'
+        ))
+    fig.update_layout(title=f'Distribution of {drug2.capitalize()} across {drug1.capitalize()} Levels',
+                      xaxis_title=f'{drug1.capitalize()} Usage',
+                      yaxis=dict(title=f'{drug2.capitalize()} Usage',
+                                 tickvals=list(range(len(drug_cube.LABEL_ORDER))), ticktext=drug_cube.LABEL_ORDER),
+                      template="plotly_dark")
+    return fig
+
+
+def pair_details(drug1, drug2, cube, corr_matrix, bundle_path, version, progress):
+    """OlapClick's figures of a pair, from the DrugCube and the pair's correlation matrix."""
+    progress(0.1, 'Computing the usage distribution...')
+    # Distribution of drug2 levels per drug1 level
+    with stage('relationship_figure'):
+        fig1 = distribution_summary_figure(cube, drug1, drug2)
+    progress(0.3, 'Computing readmitted status by combination...')
+
+    # Analysis plot: rates with 95% bootstrap intervals, support and the test against the pair's other combinations
+    with stage('combination_statistics'):
+        results_df = report.Bundle(bundle_path).statistics(f'combinations/{report.pair_name(drug1, drug2)}', version)
+        if results_df is None:
+            results_df = combination_stats.pair_statistics(cube, drug1, drug2)
+
+    with stage('analysis_figure'):
+        fig2 = go.Figure()
+
+        labels = [f'{combination} (n={support})' for combination, support in zip(results_df.index, results_df['Support'])]
+        for status in drug_cube.READMITTED_STATUSES:
+            fig2.add_trace(go.Bar(
+                x=labels,
+                y=results_df[status],
+                name=status,
+                error_y=dict(type='data', symmetric=False,
+                             array=results_df[f'{status} high'] - results_df[status],
+                             arrayminus=results_df[status] - results_df[f'{status} low']),
+                customdata=np.column_stack([results_df[f'{status} low'], results_df[f'{status} high'],
+                                            results_df['p_value'], results_df['test']]),
+                hovertemplate='%{x}<br>' + status + ': %{y:.1f}% (95% CI %{customdata[0]:.1f}-%{customdata[1]:.1f})'
+                              '<br>p = %{customdata[2]:.3g} (%{customdata[3]})<extra></extra>'
+            ))
+
+    fig2.update_layout(barmode='group',
+                       title=f'Percentage of Readmitted Status by Combination of {drug1.capitalize()} and {drug2.capitalize()}',
+                       xaxis_title='Medication Combination',
+                       yaxis_title='Percentage (%)',
+                       template="plotly_dark")
+
+    progress(0.5, 'Building summary statistics...')
+
+    # Detailed Summary Statistics
+    drug1_counts = cube.level_counts(drug1, drug2)
+    drug2_counts = cube.level_counts(drug2, drug1)
+    summary_stats = {
+        "Statistic": ["Mode", "No", "Up", "Steady", "Down", "Count"],
+        drug1.capitalize(): [
+            cube.mode(drug1),
+            drug1_counts["No"],
+            drug1_counts["Up"],
+            drug1_counts["Steady"],
+            drug1_counts["Down"],
+            sum(drug1_counts.values())
+        ],
+        drug2.capitalize(): [
+            cube.mode(drug2),
+            drug2_counts["No"],
+            drug2_counts["Up"],
+            drug2_counts["Steady"],
+            drug2_counts["Down"],
+            sum(drug2_counts.values())
+        ]
+    }
+    summary_stats_df = pd.DataFrame(summary_stats)
+
+    summary_stats_fig = go.Figure(data=[go.Table(
+        header=dict(values=list(summary_stats_df.columns),
+                    fill_color='paleturquoise',
+                    align='left'),
+        cells=dict(values=[summary_stats_df[col] for col in summary_stats_df.columns],
+                   fill_color='lavender',
+                   align='left'))
+    ])
+    summary_stats_fig.update_layout(title_text='Detailed Summary Statistics')
+    progress(0.7, 'Plotting the correlation matrix...')
+
+    # Correlation Matrix, sliced from the all-pairs matrix computed at startup
+    corr_matrix_fig = px.imshow(corr_matrix, text_auto=True, aspect='auto', color_continuous_scale='Viridis',
+                                title=f'Correlation Matrix between {drug1.capitalize()} and {drug2.capitalize()}',
+                                labels={'color': 'Correlation'})
+
+    return {'relationship': fig1, 'analysis': fig2, 'summary': summary_stats_fig, 'correlation': corr_matrix_fig}
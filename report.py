@@ -0,0 +1,400 @@
+import argparse
+import base64
+import hashlib
+import html
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from startup import lazy_import, use_agg
+
+# Plotting and analysis modules load on first use, so the dashboards can read a
+# bundle without importing them.
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sns = lazy_import('seaborn', setup=use_agg)
+mpl_figure = lazy_import('matplotlib.figure', setup=use_agg)
+combination_stats = lazy_import('combination_stats')
+drug_cube = lazy_import('drug_cube')
+medication_codes = lazy_import('medication_codes')
+
+logger = logging.getLogger(__name__)
+
+REPORT_DIR = os.environ.get('DIABETES_REPORT_DIR', 'report')
+MANIFEST = 'manifest.json'
+FORMATS = ['png']
+
+DRUG_COLORS = {
+    'metformin': ('skyblue', 'dodgerblue'),
+    'glipizide': ('salmon', 'firebrick'),
+    'glyburide': ('lightgreen', 'forestgreen'),
+    'insulin': ('orange', 'darkorange'),
+    'repaglinide': ('purple', 'indigo'),
+    'nateglinide': ('red', 'darkred'),
+    'chlorpropamide': ('cyan', 'darkcyan'),
+    'glimepiride': ('magenta', 'darkmagenta'),
+    'acetohexamide': ('lime', 'green'),
+    'tolbutamide': ('brown', 'saddlebrown')
+}
+
+# Fixed colors so a cached or bundled figure looks the same as a freshly rendered one.
+STATUS_COLORS = {
+    'Up': '#f28e2b',
+    'Down': '#e15759',
+    'No': '#4e79a7'
+}
+
+ASSOCIATION_MEASURES = ['pearson', 'cramers_v', 'p_value']
+
+
+def distribution_figure(df, column, color):
+    fig = mpl_figure.Figure(figsize=(10, 6))
+    ax = fig.subplots()
+
+    bars = sns.countplot(x=column, data=df, color=color, edgecolor='black', ax=ax)
+    for bar in bars.patches:
+        bar.set_facecolor(color)
+        bar.set_edgecolor('black')
+        bar.set_linewidth(1.5)
+        bar.set_hatch('//')
+
+        height = bar.get_height()
+        bars.annotate(f'{int(height)}',
+                      xy=(bar.get_x() + bar.get_width() / 2, height),
+                      xytext=(0, 3),
+                      textcoords="offset points",
+                      ha='center', va='bottom', fontsize=12, color='black')
+
+    ax.set_title(f'Distribution of {column.capitalize()} Usage', fontsize=16)
+    ax.set_xlabel(f'{column.capitalize()} Usage', fontsize=14)
+    ax.set_ylabel('Frequency', fontsize=14)
+    ax.grid(True, linestyle='--', alpha=0.7)
+    return fig
+
+
+def _label_codes(codes, drug):
+    values = codes.label(drug)
+    return values[values >= 0]
+
+
+def violin_figure(codes, drug):
+    """Violin plot of a drug's usage level codes (LABEL_ORDER), as the notebook draws them."""
+    fig = mpl_figure.Figure(figsize=(7, 5))
+    ax = fig.subplots()
+    sns.violinplot(y=_label_codes(codes, drug), color=DRUG_COLORS[drug][0], inner='quartile', ax=ax)
+    ax.set_yticks(range(len(medication_codes.LABEL_ORDER)))
+    ax.set_yticklabels(medication_codes.LABEL_ORDER)
+    ax.set_title(f'Violin Plot of {drug.capitalize()} Usage', fontsize=14)
+    ax.set_xlabel(f'{drug.capitalize()} Usage', fontsize=12)
+    ax.grid(True, linestyle='--', alpha=0.7)
+    return fig
+
+
+def box_figure(codes, drug):
+    fig = mpl_figure.Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    sns.boxplot(y=_label_codes(codes, drug), color=DRUG_COLORS[drug][1], linewidth=2.5, saturation=0.8, ax=ax)
+    ax.set_yticks(range(len(medication_codes.LABEL_ORDER)))
+    ax.set_yticklabels(medication_codes.LABEL_ORDER)
+    ax.set_title(f'Box Plot of {drug.capitalize()} Usage', fontsize=18, fontweight='bold', color='#4f4a4a')
+    ax.set_xlabel(f'{drug.capitalize()} Usage', fontsize=14, fontweight='bold', color='#4f4a4a')
+    ax.grid(axis='y', linestyle='--', alpha=0.7, color='#b0b0b0')
+    ax.set_facecolor('#f7f7f7')
+    return fig
+
+
+def relationship_figure(df, drug1, drug2):
+    fig = mpl_figure.Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    sns.lineplot(x=drug1, y=drug2, data=df, marker='o', color=DRUG_COLORS[drug1][1], ax=ax)
+    ax.set_title(f'Relationship between {drug1.capitalize()} and {drug2.capitalize()}', fontsize=16)
+    ax.set_xlabel(f'{drug1.capitalize()} Usage', fontsize=14)
+    ax.set_ylabel(f'{drug2.capitalize()} Usage', fontsize=14)
+    ax.grid(True, linestyle='--', alpha=0.7)
+    return fig
+
+
+def combination_figure(results_df, drug1, drug2):
+    """Grouped bars of combination_statistics with 95% bootstrap intervals; tick labels carry the support."""
+    fig = mpl_figure.Figure(figsize=(14, 8))
+    ax = fig.subplots()
+
+    statuses = drug_cube.READMITTED_STATUSES
+    positions = np.arange(len(results_df))
+    width = 0.8 / len(statuses)
+    for i, status in enumerate(statuses):
+        rates = results_df[status]
+        errors = [rates - results_df[f'{status} low'], results_df[f'{status} high'] - rates]
+        ax.bar(positions + (i - (len(statuses) - 1) / 2) * width, rates, width, yerr=errors,
+               capsize=2, label=status, color=STATUS_COLORS[status], edgecolor='black')
+    ax.set_xticks(positions)
+    ax.set_xticklabels([f'{combination} (n={support})'
+                        for combination, support in zip(results_df.index, results_df['Support'])])
+
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.set_xlabel('Medication Combination', fontsize=14)
+    ax.set_ylabel('Percentage (%)', fontsize=14)
+    ax.set_title(f'Percentage of Readmitted Status by Combination of {drug1.capitalize()} and {drug2.capitalize()}',
+                 fontsize=16)
+    ax.legend(title='Readmitted Status')
+    ax.grid(True, linestyle='--', alpha=0.7)
+    fig.tight_layout()
+    return fig
+
+
+def pair_name(drug1, drug2):
+    return f'{drug1}__{drug2}'
+
+
+def plan(medications=None):
+    """Every artifact of the report as (name, kind, args), the slowest kinds first."""
+    medications = list(medications or DRUG_COLORS)
+    pairs = list(itertools.permutations(medications, 2))
+    return ([(f'relationship/{pair_name(*pair)}', 'relationship', pair) for pair in pairs] +
+            [(f'violin/{drug}', 'violin', (drug,)) for drug in medications] +
+            [(f'combinations/{pair_name(*pair)}', 'combinations', pair) for pair in pairs] +
+            [(f'distribution/{drug}', 'distribution', (drug,)) for drug in medications] +
+            [(f'box/{drug}', 'box', (drug,)) for drug in medications] +
+            [('stats/levels', 'levels', tuple(medications)), ('stats/associations', 'associations', ())])
+
+
+# Modules whose code shapes an artifact besides this one: the statistics and
+# the dataset, cube and association matrix the builders are handed.
+CODE_MODULES = ['combination_stats', 'drug_cube', 'medication_codes', 'associations', 'dataset', 'ingest']
+
+
+def code_hash():
+    """Hash of the sources of this module and of CODE_MODULES, located without importing them."""
+    digest = hashlib.sha256()
+    for path in [__file__] + [importlib.util.find_spec(name).origin for name in CODE_MODULES]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def input_hash(kind, args, version, formats, code):
+    """What an artifact depends on: the dataset version (a content hash), its parameters and the renderer code."""
+    key = json.dumps([kind, list(args), version, sorted(formats), code])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# The dataset of the current build, set in each worker by _init_worker.
+_data = {}
+
+
+def _init_worker(df, cube, associations):
+    _data.update(df=df, cube=cube, associations=associations, codes=medication_codes.medication_codes(df))
+
+
+def _render(kind, args):
+    """(figure, stats) of one artifact; either may be None."""
+    if kind == 'distribution':
+        return distribution_figure(_data['df'], args[0], DRUG_COLORS[args[0]][0]), None
+    if kind == 'violin':
+        return violin_figure(_data['codes'], args[0]), None
+    if kind == 'box':
+        return box_figure(_data['codes'], args[0]), None
+    if kind == 'relationship':
+        return relationship_figure(_data['df'], *args), None
+    if kind == 'combinations':
+        results_df = combination_stats.pair_statistics(_data['cube'], *args)
+        return combination_figure(results_df, *args), results_df.to_json(orient='table')
+    if kind == 'levels':
+        cube = _data['cube']
+        levels = {drug: {'counts': dict(zip(drug_cube.USAGE_LEVELS, cube.level_totals[drug].tolist())),
+                         'mode': cube.mode(drug)} for drug in args}
+        return None, json.dumps(levels)
+    if kind == 'associations':
+        associations = _data['associations']
+        return None, json.dumps({measure: json.loads(associations.measure(measure).to_json())
+                                 for measure in ASSOCIATION_MEASURES})
+    raise ValueError(f'Unknown artifact kind {kind!r}')
+
+
+def _write(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def build_artifact(output_dir, name, kind, args, formats):
+    """Render one artifact into ``output_dir``; returns its files (relative path -> SHA-256) and the time taken."""
+    start = time.perf_counter()
+    fig, stats = _render(kind, args)
+    files = {}
+    if fig is not None:
+        for fmt in formats:
+            buf = io.BytesIO()
+            fig.savefig(buf, format=fmt)
+            files[f'{name}.{fmt}'] = _write(os.path.join(output_dir, f'{name}.{fmt}'), buf.getvalue())
+    if stats is not None:
+        files[f'{name}.json'] = _write(os.path.join(output_dir, f'{name}.json'), stats.encode('utf-8'))
+    return files, time.perf_counter() - start
+
+
+def read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'artifacts': {}}
+
+
+def write_manifest(output_dir, manifest):
+    _write(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=1).encode('utf-8'))
+
+
+def write_index(output_dir, manifest):
+    sections = {}
+    for name, entry in sorted(manifest['artifacts'].items()):
+        sections.setdefault(name.split('/')[0], []).extend(entry['files'])
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>Descriptive report</title></head><body>',
+             f'<h1>Descriptive report</h1><p>Dataset version {html.escape(str(manifest.get("version")))}</p>']
+    for section, files in sections.items():
+        parts.append(f'<h2>{html.escape(section.capitalize())}</h2>')
+        for path in files:
+            # One image per figure: the PNG, or the SVG when only that was built.
+            if path.endswith('.png') or (path.endswith('.svg') and f'{path[:-4]}.png' not in files):
+                parts.append(f'<img src="{html.escape(path)}" style="max-width: 48%" loading="lazy">')
+            elif path.endswith('.json'):
+                parts.append(f'<a href="{html.escape(path)}">{html.escape(path)}</a><br>')
+    parts.append('</body></html>')
+    _write(os.path.join(output_dir, 'index.html'), '\n'.join(parts).encode('utf-8'))
+
+
+def build_report(output_dir=REPORT_DIR, formats=FORMATS, n_jobs=None, force=False, csv_path=None, store_dir=None):
+    """Render the descriptive report's figures and statistics into a static bundle, in a process pool.
+
+    An artifact is skipped when the manifest records the same input hash and
+    its files are still there, so a rebuild without new data only reads the
+    dataset version. Each worker receives the dataset once, through the pool
+    initializer.
+    """
+    from dataset import CLEANED_CSV
+    from ingest import INGEST_DIR, LiveDataset, current_version
+
+    csv_path, store_dir = csv_path or CLEANED_CSV, store_dir or INGEST_DIR
+    start = time.perf_counter()
+    manifest = read_manifest(output_dir)
+    code = code_hash()
+
+    def stale(version):
+        tasks = []
+        for name, kind, args in plan():
+            entry = manifest['artifacts'].get(name)
+            key = input_hash(kind, args, version, formats, code)
+            fresh = (not force and entry is not None and entry['input'] == key and
+                     all(os.path.exists(os.path.join(output_dir, path)) for path in entry['files']))
+            if not fresh:
+                tasks.append((name, kind, args, key))
+        return tasks
+
+    version = current_version(csv_path, store_dir)
+    tasks = stale(version)
+    built, failed = [], []
+    if tasks:
+        data = LiveDataset(csv_path, store_dir)
+        if data.version != version:
+            version = data.version
+            tasks = stale(version)
+        initargs = (data.df, data.cube, data.associations)
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=initargs) as executor:
+            futures = {executor.submit(build_artifact, output_dir, name, kind, args, formats): (name, key)
+                       for name, kind, args, key in tasks}
+            for future in as_completed(futures):
+                name, key = futures[future]
+                try:
+                    files, seconds = future.result()
+                except Exception:
+                    logger.exception('Rendering %s failed', name)
+                    manifest['artifacts'].pop(name, None)
+                    failed.append(name)
+                    continue
+                manifest['artifacts'][name] = {'input': key, 'version': version, 'files': files, 'seconds': seconds}
+                built.append(name)
+
+    names = {name for name, _, _ in plan()}
+    manifest['artifacts'] = {name: entry for name, entry in manifest['artifacts'].items() if name in names}
+    manifest.update(version=version, formats=list(formats), built=time.time())
+    write_manifest(output_dir, manifest)
+    write_index(output_dir, manifest)
+    return {'version': version, 'built': len(built), 'skipped': len(names) - len(built) - len(failed),
+            'failed': failed, 'seconds': time.perf_counter() - start}
+
+
+class Bundle:
+    """Read side of a report directory for the dashboards; artifacts of another dataset version are ignored."""
+
+    def __init__(self, path=REPORT_DIR):
+        self.path = path
+        self._manifest = {'artifacts': {}}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def manifest(self):
+        try:
+            mtime = os.stat(os.path.join(self.path, MANIFEST)).st_mtime_ns
+        except OSError:
+            return {'artifacts': {}}
+        if mtime != self._mtime:
+            with self._lock:
+                self._manifest, self._mtime = read_manifest(self.path), mtime
+        return self._manifest
+
+    def file(self, name, extension, version):
+        entry = self.manifest()['artifacts'].get(name)
+        if entry is None or entry['version'] != version or f'{name}.{extension}' not in entry['files']:
+            return None
+        path = os.path.join(self.path, f'{name}.{extension}')
+        return path if os.path.exists(path) else None
+
+    def image(self, name, version):
+        """The artifact's PNG as a data URI, or None."""
+        path = self.file(name, 'png', version)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return 'data:image/png;base64,{}'.format(base64.b64encode(f.read()).decode('utf-8'))
+
+    def statistics(self, name, version):
+        """The DataFrame stored with a 'combinations/...' artifact, or None."""
+        path = self.file(name, 'json', version)
+        if path is None:
+            return None
+        with open(path, encoding='utf-8') as f:
+            return pd.read_json(io.StringIO(f.read()), orient='table')
+
+
+def add_bundle_route(server, bundle_dir=REPORT_DIR, path='/report'):
+    """Serve the bundle's files (and its index.html at ``path``/) from the Flask server."""
+    from flask import send_from_directory
+
+    directory = os.path.abspath(bundle_dir)
+    server.add_url_rule(f'{path}/', 'report_index', lambda: send_from_directory(directory, 'index.html'))
+    server.add_url_rule(f'{path}/<path:filename>', 'report_file',
+                        lambda filename: send_from_directory(directory, filename))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the descriptive report into a static bundle.')
+    parser.add_argument('--output', default=REPORT_DIR)
+    parser.add_argument('--formats', nargs='+', choices=['png', 'svg'], default=FORMATS)
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='rebuild artifacts whose inputs did not change')
+    parser.add_argument('--csv', help='cleaned dataset (default: the dashboards\')')
+    parser.add_argument('--store', help='ingest store (default: the dashboards\')')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = build_report(args.output, args.formats, args.jobs, args.force, args.csv, args.store)
+    print(f"Version {summary['version']}: built {summary['built']}, skipped {summary['skipped']}, "
+          f"failed {len(summary['failed'])} in {summary['seconds']:.1f}s -> {args.output}")
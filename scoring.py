@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import pickle
+import queue
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import sklearn
+from flask import Flask, jsonify, request
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from linear_svm import DedupLinearSVM
+from medication_codes import MEDICATIONS, MedicationCodes
+
+MODEL_PATH = os.environ.get('READMISSION_MODEL', 'readmission_model.pkl')
+ID_COLUMNS = ['encounter_id', 'patient_nbr']
+CHUNK_SIZE = 100_000
+
+
+class MedicationEncoder(TransformerMixin, BaseEstimator):
+    """``pd.get_dummies(X[medications], drop_first=True)`` with the levels frozen at fit time.
+
+    New data always produces the same columns in the same order; levels not
+    seen during training encode as all zeros.
+    """
+
+    def __init__(self, medications=MEDICATIONS, drop_first=True):
+        self.medications = medications
+        self.drop_first = drop_first
+
+    def fit(self, X, y=None):
+        codes = MedicationCodes.from_frame(X, self.medications)
+        self.levels_ = {drug: codes.present_levels(drug) for drug in self.medications}
+        self.feature_names_ = [f'{drug}_{level}' for drug in self.medications
+                               for level in self.levels_[drug][int(self.drop_first):]]
+        return self
+
+    def transform(self, X):
+        encoded, _ = MedicationCodes.from_frame(X, self.medications).one_hot(self.medications, self.levels_,
+                                                                              self.drop_first)
+        return encoded
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array(self.feature_names_, dtype=object)
+
+
+class ReadmissionModel:
+    """A fitted classifier together with the encoder that built its features."""
+
+    def __init__(self, encoder, estimator, metadata=None):
+        self.encoder = encoder
+        self.estimator = estimator
+        self.metadata = {'sklearn': sklearn.__version__, 'trained': time.time(),
+                         'features': list(encoder.feature_names_), **(metadata or {})}
+
+    @property
+    def classes_(self):
+        return self.estimator.classes_
+
+    def score_frame(self, df):
+        """Predicted readmitted class plus one decision score per class for every row of ``df``."""
+        X = self.encoder.transform(df)
+        scores = self.estimator.decision_function(X)
+        if scores.ndim == 1:
+            scores = np.column_stack([-scores, scores])
+        result = pd.DataFrame(scores, columns=[f'score_{label}' for label in self.classes_], index=df.index)
+        result.insert(0, 'prediction', self.classes_[scores.argmax(axis=1)])
+        return result
+
+    def save(self, path=MODEL_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path=MODEL_PATH):
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        trained_with = model.metadata.get('sklearn')
+        if trained_with and trained_with != sklearn.__version__:
+            warnings.warn(f'{path} was trained with scikit-learn {trained_with}, running {sklearn.__version__}')
+        return model
+
+
+def train_model(df, estimator=None, target='readmitted'):
+    encoder = MedicationEncoder().fit(df)
+    estimator = estimator if estimator is not None else DedupLinearSVM()
+    estimator.fit(encoder.transform(df), df[target].astype(str))
+    return ReadmissionModel(encoder, estimator, {'rows': len(df), 'dataset_version': df.attrs.get('version')})
+
+
+_model = None
+
+
+def _init_worker(model_path):
+    global _model
+    _model = ReadmissionModel.load(model_path)
+
+
+def _score_chunk(chunk):
+    ids = chunk[[column for column in ID_COLUMNS if column in chunk.columns]]
+    return pd.concat([ids, _model.score_frame(chunk)], axis=1)
+
+
+def score_csv(input_path, output_path, model_path=MODEL_PATH, chunksize=CHUNK_SIZE, n_jobs=None):
+    """Stream ``input_path`` in chunks, score them in a process pool and append the results to ``output_path``.
+
+    At most two chunks per worker are in flight, so memory stays bounded by
+    the chunk size; results are written in input order as soon as they are ready.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    header = pd.read_csv(input_path, nrows=0).columns
+    usecols = [column for column in ID_COLUMNS + MEDICATIONS if column in header]
+
+    start = time.perf_counter()
+    rows = 0
+    tmp_path = output_path + '.tmp'
+    with ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(model_path,)) as executor, \
+            open(tmp_path, 'w', newline='') as f:
+        pending = deque()
+        chunks = pd.read_csv(input_path, usecols=usecols, chunksize=chunksize)
+        for chunk in chunks:
+            pending.append(executor.submit(_score_chunk, chunk))
+            if len(pending) >= 2 * n_jobs:
+                result = pending.popleft().result()
+                result.to_csv(f, index=False, header=rows == 0)
+                rows += len(result)
+        while pending:
+            result = pending.popleft().result()
+            result.to_csv(f, index=False, header=rows == 0)
+            rows += len(result)
+    os.replace(tmp_path, output_path)
+
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds, 'records_per_sec': rows / seconds if seconds else float('inf'),
+            'workers': n_jobs}
+
+
+class MicroBatcher:
+    """Coalesces concurrent scoring requests into one vectorized call.
+
+    A request waits at most ``max_wait`` seconds for others to join its batch,
+    and a batch holds at most ``max_batch`` records.
+    """
+
+    def __init__(self, model, max_batch=512, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.records = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.started = time.time()
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def score(self, records, timeout=30):
+        future = Future()
+        self._queue.put((records, future))
+        return future.result(timeout)
+
+    def _collect(self):
+        items = [self._queue.get()]
+        size = len(items[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            size += len(items[-1][0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            start = time.perf_counter()
+            try:
+                frame = pd.DataFrame([record for records, _ in items for record in records],
+                                     columns=self.model.encoder.medications)
+                results = self.model.score_frame(frame).to_dict('records')
+            except Exception as error:
+                for _, future in items:
+                    future.set_exception(error)
+                continue
+            self.busy_seconds += time.perf_counter() - start
+            self.records += len(results)
+            self.batches += 1
+            offset = 0
+            for records, future in items:
+                future.set_result(results[offset:offset + len(records)])
+                offset += len(records)
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'batches': self.batches,
+            'mean_batch': self.records / self.batches if self.batches else 0,
+            'records_per_sec': self.records / self.busy_seconds if self.busy_seconds else 0,
+            'uptime_records_per_sec': self.records / (time.time() - self.started),
+        }
+
+
+def create_app(model, max_batch=512, max_wait=0.005):
+    """Flask app scoring one record (a JSON object) or a micro-batch (a JSON list) per POST /score."""
+    app = Flask(__name__)
+    batcher = MicroBatcher(model, max_batch, max_wait)
+
+    @app.route('/score', methods=['POST'])
+    def score():
+        payload = request.get_json(silent=True)
+        records = payload if isinstance(payload, list) else [payload]
+        if not records or not all(isinstance(record, dict) for record in records):
+            return jsonify(error='expected a JSON object or a list of objects'), 400
+        results = batcher.score(records)
+        return jsonify(results if isinstance(payload, list) else results[0])
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(batcher.stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train, batch-score and serve the readmission model.')
+    parser.add_argument('--model', default=MODEL_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('train', help='fit the model on the cleaned dataset and save it')
+    score = subparsers.add_parser('score', help='score a CSV of patients')
+    score.add_argument('input')
+    score.add_argument('output')
+    score.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    score.add_argument('--jobs', type=int)
+    serve = subparsers.add_parser('serve', help='serve POST /score over HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8060)
+    serve.add_argument('--max-batch', type=int, default=512)
+    serve.add_argument('--max-wait-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        from dataset import load_dataset
+
+        start = time.perf_counter()
+        model = train_model(load_dataset())
+        model.save(args.model)
+        print(f'Saved {args.model} ({len(model.encoder.feature_names_)} features) '
+              f'in {time.perf_counter() - start:.1f}s')
+    elif args.command == 'score':
+        print(json.dumps(score_csv(args.input, args.output, args.model, args.chunksize, args.jobs)))
+    else:
+        app = create_app(ReadmissionModel.load(args.model), args.max_batch, args.max_wait_ms / 1000)
+        app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
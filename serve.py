@@ -0,0 +1,57 @@
+import argparse
+import importlib
+import os
+
+import gunicorn_config
+
+
+def serve_gunicorn(module_name, options):
+    from gunicorn.app.base import BaseApplication
+
+    if options['preload_app']:
+        os.environ.setdefault('DASH_DATA_LOAD', 'eager')
+
+    class DashApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return importlib.import_module(module_name).server
+
+    DashApplication().run()
+
+
+def serve_waitress(module_name, host, port, threads):
+    from waitress import serve
+
+    serve(importlib.import_module(module_name).server, host=host, port=port, threads=threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a dashboard with a production WSGI server.')
+    parser.add_argument('app', choices=['OLAP', 'OlapClick'], help='dashboard module to serve')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--workers', type=int, default=gunicorn_config.workers)
+    parser.add_argument('--threads', type=int, default=gunicorn_config.threads)
+    parser.add_argument('--server', choices=['gunicorn', 'waitress'],
+                        default='waitress' if os.name == 'nt' else 'gunicorn',
+                        help='gunicorn (preforked workers, POSIX only) or waitress (threads, also on Windows)')
+    args = parser.parse_args()
+
+    if args.server == 'waitress':
+        serve_waitress(args.app, args.host, args.port, args.threads)
+    else:
+        serve_gunicorn(args.app, {
+            'bind': f'{args.host}:{args.port}',
+            'workers': args.workers,
+            'threads': args.threads,
+            'worker_class': gunicorn_config.worker_class,
+            'timeout': gunicorn_config.timeout,
+            'preload_app': gunicorn_config.preload_app,
+        })
+
+
+if __name__ == '__main__':
+    main()
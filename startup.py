@@ -0,0 +1,182 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 'background' starts loading the data when the app is created and serves
+# requests meanwhile, 'lazy' waits for the first callback that needs it and
+# 'eager' loads it before the app is returned.
+DATA_LOAD = os.environ.get('DASH_DATA_LOAD', 'background')
+
+_phases = []
+_phases_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+def record(phase, seconds):
+    with _phases_lock:
+        _phases.append({'phase': phase, 'seconds': seconds, 'at': time.perf_counter() - _origin,
+                        'thread': threading.current_thread().name})
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+def report():
+    """Startup phases (imports, app creation, data load) in the order they finished."""
+    with _phases_lock:
+        return {'pid': os.getpid(), 'phases': list(_phases)}
+
+
+def add_report_route(server, path='/startup'):
+    from flask import jsonify
+
+    server.add_url_rule(path, 'startup_report', lambda: jsonify(report()))
+
+
+class LazyModule(types.ModuleType):
+    """Module placeholder that imports the real module on first attribute access and records how long it took."""
+
+    def __init__(self, name, setup=None):
+        super().__init__(name)
+        self._setup = setup
+        self._module = None
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with timed(f'import {self.__name__}'):
+                        if self._setup is not None:
+                            self._setup()
+                        self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+
+def lazy_import(name, setup=None):
+    """``import name``, deferred until the module is used; ``setup`` runs right before the import."""
+    return LazyModule(name, setup)
+
+
+def use_agg():
+    """``setup`` for matplotlib imports: render to buffers and files, no display needed."""
+    importlib.import_module('matplotlib').use('Agg')
+
+
+class LazyDataset:
+    """Handle on a dataset object that is built on first use or prewarmed in a background thread.
+
+    Attribute access is forwarded to the object, waiting for it if it is still
+    loading. A load interrupted by a fork (gunicorn's preload) starts over in
+    the child. Callbacks registered with ``on_ready`` run in a background
+    thread once the object is loaded.
+    """
+
+    def __init__(self, factory, name='dataset'):
+        self._factory = factory
+        self._name = name
+        self._value = None
+        self._mode = None
+        self._ready_callbacks = []
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._value is None and self._mode == 'background':
+            self._prewarm()
+        elif self._value is not None:
+            # Threads do not survive a fork; rerun the callbacks, which may find their work half done.
+            for callback in self._ready_callbacks:
+                self._run_ready(callback)
+
+    def _prewarm(self):
+        threading.Thread(target=self._load_in_background, name=f'prewarm-{self._name}', daemon=True).start()
+
+    def _load_in_background(self):
+        try:
+            self.get()
+        except Exception:
+            logger.exception('Loading %s failed, it will be retried on first use', self._name)
+
+    def _run_ready(self, callback):
+        threading.Thread(target=callback, name=f'{callback.__name__}-{self._name}', daemon=True).start()
+
+    def on_ready(self, callback):
+        """Run ``callback()`` in a background thread once the object is loaded (now, if it already is)."""
+        self._ready_callbacks.append(callback)
+        if self._value is not None:
+            self._run_ready(callback)
+
+    def start(self, mode=DATA_LOAD):
+        self._mode = mode
+        if mode == 'eager':
+            self.get()
+        elif mode == 'background':
+            self._prewarm()
+        elif mode != 'lazy':
+            raise ValueError(f'Unknown data load mode {mode!r}')
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    with timed(f'load {self._name}'):
+                        self._value = self._factory()
+                    logger.info('Startup report: %s', json.dumps(report()))
+                    for callback in self._ready_callbacks:
+                        self._run_ready(callback)
+        return self._value
+
+    def refresh(self, force=False):
+        """Forwarded to the dataset once it is loaded; a load in progress picks up the latest data anyway."""
+        return self._value.refresh(force) if self._value is not None else False
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('_'):
+            raise AttributeError(attribute)
+        return getattr(self.get(), attribute)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the cold start of a dashboard module.')
+    parser.add_argument('app', choices=['OLAP', 'OlapClick'])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with timed(f'import {args.app}'):
+        module = importlib.import_module(args.app)
+    ready = time.perf_counter() - start
+    module.data.get()
+    loaded = time.perf_counter() - start
+
+    for phase in report()['phases']:
+        print(f"{phase['phase']:<40} {phase['seconds']:8.3f}s  (done at {phase['at']:.3f}s, {phase['thread']})")
+    print(f'Serving requests after {ready:.3f}s, data loaded after {loaded:.3f}s')
+
+
+if __name__ == '__main__':
+    # Through the importable module, whose report is the one the dashboards write to.
+    importlib.import_module('startup').main()
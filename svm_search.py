@@ -0,0 +1,195 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import linear_kernel, polynomial_kernel, rbf_kernel, sigmoid_kernel
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.svm import SVC
+
+PARAM_GRID = {
+    'C': [0.1, 1, 10, 100],
+    'gamma': [1, 0.1, 0.01, 0.001],
+    'kernel': ['linear', 'rbf', 'poly', 'sigmoid']
+}
+
+_X = None
+_y = None
+
+
+def _init_worker(X, y):
+    global _X, _y
+    _X, _y = X, y
+
+
+def compute_kernel(X, Y, kernel, gamma=None):
+    """Gram matrix with the same kernel definitions as SVC, given a numeric ``gamma``.
+
+    SVC's default gamma='scale' depends on the variance of the training rows,
+    so it has no fixed Gram matrix; _evaluate_group fits those on the rows.
+    """
+    if kernel == 'linear':
+        return linear_kernel(X, Y)
+    if kernel == 'rbf':
+        return rbf_kernel(X, Y, gamma=gamma)
+    if kernel == 'poly':
+        return polynomial_kernel(X, Y, degree=3, gamma=gamma, coef0=0.0)
+    if kernel == 'sigmoid':
+        return sigmoid_kernel(X, Y, gamma=gamma, coef0=0.0)
+    raise ValueError(f'Unsupported kernel: {kernel}')
+
+
+def _evaluate_group(kernel_params, Cs, sample, folds, precompute, time_budget, cache_size):
+    """Cross-validate every C for one kernel setting on a subsample.
+
+    All C values share the kernel, so the Gram matrix of the subsample is
+    computed once and sliced for every fold instead of letting each fit rebuild it.
+    """
+    X, y = _X[sample], _y[sample]
+    kernel = kernel_params.get('kernel', 'rbf')
+    gamma = kernel_params.get('gamma', 'scale')
+    K = None
+    if precompute and (kernel == 'linear' or not isinstance(gamma, str)):
+        K = compute_kernel(X, X, kernel, None if kernel == 'linear' else gamma)
+
+    results = []
+    for C in Cs:
+        scores = []
+        elapsed = 0.0
+        timed_out = False
+        for train, test in folds:
+            start = time.perf_counter()
+            if K is not None:
+                model = SVC(kernel='precomputed', C=C).fit(K[np.ix_(train, train)], y[train])
+                scores.append(model.score(K[np.ix_(test, train)], y[test]))
+            else:
+                model = SVC(C=C, cache_size=cache_size, **kernel_params).fit(X[train], y[train])
+                scores.append(model.score(X[test], y[test]))
+            elapsed += time.perf_counter() - start
+            if time_budget is not None and elapsed > time_budget:
+                timed_out = True
+                break
+        results.append({'C': C, **kernel_params, 'mean_score': float(np.mean(scores)),
+                        'fit_seconds': elapsed, 'timed_out': timed_out})
+    return results
+
+
+def _candidates(param_grid):
+    """Expand the grid, dropping gamma for linear kernels where SVC ignores it."""
+    seen = []
+    for params in ParameterGrid(param_grid):
+        params = dict(params)
+        if params.get('kernel', 'rbf') == 'linear':
+            params.pop('gamma', None)
+        if params not in seen:
+            seen.append(params)
+    return seen
+
+
+class SVMHalvingSearch:
+    """Successive-halving replacement for GridSearchCV(SVC(), param_grid).
+
+    Every rung cross-validates the surviving configurations on a larger random
+    subsample (``min_samples * factor ** rung`` rows) and keeps the best
+    ``1 / factor`` of them, so the expensive full-size fits only happen for a
+    handful of candidates. Configurations whose fits exceed ``time_budget``
+    seconds in a rung are eliminated, and the search fails if none is left.
+    Exposes ``best_params_``, ``best_score_``, ``best_estimator_`` and
+    ``cv_results_`` like GridSearchCV.
+    """
+
+    def __init__(self, param_grid=PARAM_GRID, cv=5, factor=3, min_samples=2000, n_jobs=None,
+                 time_budget=None, precompute_limit=6000, cache_size=1000, random_state=42, verbose=0):
+        self.param_grid = param_grid
+        self.cv = cv
+        self.factor = factor
+        self.min_samples = min_samples
+        self.n_jobs = n_jobs
+        self.time_budget = time_budget
+        self.precompute_limit = precompute_limit
+        self.cache_size = cache_size
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def _n_workers(self):
+        if self.n_jobs is None:
+            return 1
+        if self.n_jobs < 0:
+            return os.cpu_count() or 1
+        return self.n_jobs
+
+    def _run_rung(self, executor, candidates, sample, folds):
+        groups = {}
+        for params in candidates:
+            kernel_params = {key: value for key, value in params.items() if key != 'C'}
+            groups.setdefault(tuple(sorted(kernel_params.items())), []).append(params['C'])
+
+        precompute = len(sample) <= self.precompute_limit
+        args = [(dict(key), Cs, sample, folds, precompute, self.time_budget, self.cache_size)
+                for key, Cs in groups.items()]
+        if executor is None:
+            batches = [_evaluate_group(*arg) for arg in args]
+        else:
+            batches = executor.map(_evaluate_group, *zip(*args))
+        return [result for batch in batches for result in batch]
+
+    def fit(self, X, y):
+        X_values = np.ascontiguousarray(np.asarray(X, dtype=np.float64))
+        y_values = np.asarray(y)
+        n_rows = len(X_values)
+        order = np.random.default_rng(self.random_state).permutation(n_rows)
+
+        candidates = _candidates(self.param_grid)
+        n_samples = min(self.min_samples, n_rows)
+        history = []
+        rung = 0
+
+        n_workers = self._n_workers()
+        executor = None
+        if n_workers > 1:
+            executor = ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(X_values, y_values))
+        else:
+            _init_worker(X_values, y_values)
+
+        try:
+            while True:
+                start = time.perf_counter()
+                sample = np.sort(order[:n_samples])
+                folds = list(StratifiedKFold(self.cv, shuffle=True, random_state=self.random_state)
+                             .split(np.zeros(n_samples), y_values[sample]))
+                results = self._run_rung(executor, candidates, sample, folds)
+                for result in results:
+                    result.update(rung=rung, n_samples=n_samples)
+                history.extend(results)
+
+                finished = [r for r in results if not r['timed_out']]
+                if not finished:
+                    raise RuntimeError(f'All {len(results)} configurations exceeded the time budget of '
+                                       f'{self.time_budget}s on {n_samples} rows')
+                ranked = sorted(finished, key=lambda r: r['mean_score'], reverse=True)
+                keep = max(1, math.ceil(len(ranked) / self.factor))
+                candidates = [{key: r[key] for key in ('C', 'kernel', 'gamma') if key in r} for r in ranked[:keep]]
+                if self.verbose:
+                    print(f'Rung {rung}: {len(results)} candidates on {n_samples} rows in '
+                          f'{time.perf_counter() - start:.1f}s, best {ranked[0]["mean_score"]:.4f} '
+                          f'with {candidates[0]}')
+
+                if len(candidates) == 1 or n_samples == n_rows:
+                    break
+                n_samples = min(n_samples * self.factor, n_rows)
+                rung += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.best_params_ = candidates[0]
+        self.best_score_ = ranked[0]['mean_score']
+        self.cv_results_ = pd.DataFrame(history)
+
+        start = time.perf_counter()
+        self.best_estimator_ = SVC(cache_size=self.cache_size, **self.best_params_).fit(X, y)
+        if self.verbose:
+            print(f'Refit {self.best_params_} on {n_rows} rows in {time.perf_counter() - start:.1f}s')
+        return self